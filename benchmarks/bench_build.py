@@ -0,0 +1,64 @@
+"""Compare build throughput of the pipelined and the sequential paths.
+
+Usage: python benchmarks/bench_build.py [n_files] [notes_per_file]
+"""
+import filecmp
+import io
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from fixture import makeDeckSet
+
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+
+
+def _timeBuild(base, build_dir, pipelined):
+    shutil.rmtree(build_dir, ignore_errors=True)
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        builder.build(None, base, build_dir, None, pipelined=pipelined)
+    return time.perf_counter() - start
+
+
+def _sameTree(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.diff_files or comparison.left_only or comparison.right_only:
+        return False
+    return all(
+        _sameTree(os.path.join(left, sub), os.path.join(right, sub))
+        for sub in comparison.common_dirs)
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    notes_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = makeDeckSet(os.path.join(tmp, 'deck-set'), n_files,
+                           notes_per_file)
+        sequential_dir = os.path.join(tmp, 'build-sequential')
+        pipelined_dir = os.path.join(tmp, 'build-pipelined')
+
+        # Warm the OS cache and the guid map before timing.
+        _timeBuild(base, sequential_dir, False)
+        sequential = _timeBuild(base, sequential_dir, False)
+        pipelined = _timeBuild(base, pipelined_dir, True)
+
+        identical = _sameTree(sequential_dir, pipelined_dir)
+
+    n_notes = n_files * notes_per_file
+    util.msg("Notes:      %d in %d files" % (n_notes, n_files))
+    util.msg("Sequential: %.3fs (%.0f notes/s)" %
+             (sequential, n_notes / sequential))
+    util.msg("Pipelined:  %.3fs (%.0f notes/s)" %
+             (pipelined, n_notes / pipelined))
+    util.msg("Identical output: %s" % ('yes' if identical else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
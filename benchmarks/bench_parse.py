@@ -0,0 +1,56 @@
+"""Compare note parse throughput of data.yaml and JSON Lines files.
+
+Usage: python benchmarks/bench_parse.py [n_files] [notes_per_file]
+"""
+import glob
+import os.path
+import sys
+import tempfile
+import time
+
+from fixture import makeDeckSet
+
+import ankidmpy.util as util
+
+
+def _timeParse(paths, parse):
+    contents = [(path, util.getRaw(path)) for path in paths]
+    start = time.perf_counter()
+    n_notes = 0
+    for path, raw in contents:
+        n_notes += len(parse(path, raw)['notes'])
+    return n_notes, time.perf_counter() - start
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    notes_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = makeDeckSet(os.path.join(tmp, 'deck-set'), n_files,
+                           notes_per_file)
+        yaml_paths = sorted(
+            glob.glob(os.path.join(base, 'notes', '**', 'data.yaml'),
+                      recursive=True))
+        jsonl_paths = []
+        for path in yaml_paths:
+            jsonl_path = path[:-len('.yaml')] + util.JSONL_EXT
+            util.writeRaw(jsonl_path, util.dumpNotes(jsonl_path,
+                                                     util.getNotes(path)))
+            jsonl_paths.append(jsonl_path)
+
+        n_notes, yaml_time = _timeParse(yaml_paths, util.parseNotes)
+        _, jsonl_time = _timeParse(jsonl_paths, util.parseNotes)
+        yaml_bytes = sum(os.path.getsize(path) for path in yaml_paths)
+        jsonl_bytes = sum(os.path.getsize(path) for path in jsonl_paths)
+
+    util.msg("Notes:    %d in %d files" % (n_notes, len(yaml_paths)))
+    util.msg("YAML:     %.3fs (%.0f notes/s, %.1f MB/s)" %
+             (yaml_time, n_notes / yaml_time, yaml_bytes / yaml_time / 1e6))
+    util.msg("JSONL:    %.3fs (%.0f notes/s, %.1f MB/s)" %
+             (jsonl_time, n_notes / jsonl_time, jsonl_bytes / jsonl_time / 1e6))
+    util.msg("Speedup:  %.1fx" % (yaml_time / jsonl_time,))
+
+
+if __name__ == '__main__':
+    main()
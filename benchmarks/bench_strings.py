@@ -0,0 +1,55 @@
+"""Report unique versus total string bytes retained by note loading.
+
+Usage: python benchmarks/bench_strings.py [n_files] [notes_per_file]
+"""
+import os.path
+import sys
+import tempfile
+
+from fixture import makeDeckSet
+
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+
+
+def main():
+    n_files = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    notes_per_file = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as tmp:
+        base = makeDeckSet(os.path.join(tmp, 'deck-set'), n_files,
+                           notes_per_file)
+        config = builder.loadAnkiDmConfig(base)
+        strings = util.createStringTable()
+        notes = builder.loadCrawledNotes(config, strings)
+        path_tags_cache = dict()
+        for note_entry in notes:
+            builder._noteTags(note_entry, config['path_tags'],
+                              path_tags_cache, strings)
+
+    # Field values are counted by object, so interned repeats count once.
+    value_bytes = 0
+    unique_values = dict()
+    for note_entry in notes:
+        note = note_entry['note']
+        mappings = [note.get('fields') or {}]
+        mappings.extend((note.get('fields_by_lang') or {}).values())
+        for mapping in mappings:
+            for value in mapping.values():
+                value_bytes += sys.getsizeof(value)
+                unique_values[id(value)] = sys.getsizeof(value)
+
+    stats = util.stringTableStats(strings)
+    util.msg("Notes:          %d" % len(notes))
+    util.msg("Strings:        %d unique / %d total" %
+             (stats['unique_count'], stats['total_count']))
+    util.msg("String bytes:   %d unique / %d total (%.1f%% retained)" %
+             (stats['unique_bytes'], stats['total_bytes'],
+              100.0 * stats['unique_bytes'] / max(stats['total_bytes'], 1)))
+    retained = sum(unique_values.values())
+    util.msg("Field values:   %d bytes retained / %d referenced (saved %d)" %
+             (retained, value_bytes, value_bytes - retained))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Synthetic deck-set generator shared by the benchmark scripts."""
+import json
+import os.path
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import ankidmpy.util as util
+
+MODEL_UUID = '11111111-1111-1111-1111-111111111111'
+
+
+def makeDeckSet(directory, n_files=100, notes_per_file=50, langs=('fr',)):
+    util.prepareDir(directory)
+    with open(os.path.join(directory, 'models.yaml'), 'w') as f:
+        f.write(
+            util.toYaml(
+                dict(models=[
+                    dict(id='basic',
+                         name='Basic',
+                         uuid=MODEL_UUID,
+                         info=dict(type=0, vers=[]),
+                         fields=['Front', 'Back', 'Back Extra'],
+                         templates=[
+                             dict(name='Card 1',
+                                  qfmt='{{Front}}',
+                                  afmt='{{FrontSide}}<hr id=answer>{{Back}}')
+                         ],
+                         css='.card { font-family: arial; }')
+                ])))
+    with open(os.path.join(directory, 'ankidm.yaml'), 'w') as f:
+        f.write(
+            util.toYaml(
+                dict(crawl=dict(root='notes', include=['**/data.yaml']),
+                     path_tags=dict(levels=[
+                         dict(name='subject', index=0),
+                         dict(name='src', index=1, value_tag_prefix='src'),
+                         dict(name='ch',
+                              index=2,
+                              tag_name='chapter',
+                              value_template='{src}::{ch}')
+                     ]))))
+    for name in ('deck.json', 'config.json'):
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(util.toJson({}))
+    with open(os.path.join(directory, 'desc.html'), 'w') as f:
+        f.write('')
+    util.prepareDir(os.path.join(directory, 'media'))
+
+    deck_dir = os.path.join(directory, 'decks', 'Bench')
+    util.prepareDir(deck_dir)
+    with open(os.path.join(deck_dir, 'build.json'), 'w') as f:
+        f.write(
+            json.dumps(
+                dict(deck=dict(uuid='22222222-2222-2222-2222-222222222222'),
+                     config=dict(uuid='33333333-3333-3333-3333-333333333333',
+                                 name='Bench'),
+                     models=dict(basic=dict(uuid=MODEL_UUID, name='Basic')))))
+
+    for file_idx in range(n_files):
+        rel_dir = os.path.join('notes', 'subject%d' % (file_idx % 5),
+                               'book%d' % (file_idx % 20),
+                               'chapter%d' % file_idx)
+        util.prepareDir(os.path.join(directory, rel_dir))
+        notes = []
+        for note_idx in range(notes_per_file):
+            note = dict(id='n%d-%d' % (file_idx, note_idx),
+                        model='basic',
+                        fields={
+                            'Front': 'Question %d.%d' % (file_idx, note_idx),
+                            'Back': 'Answer %d.%d' % (file_idx, note_idx),
+                            'Back Extra': 'See the chapter summary.'
+                        },
+                        tags=['generated', 'level%d' % (note_idx % 3)])
+            if note_idx % 4 == 0:
+                note['fields_by_lang'] = dict(
+                    (lang, {'Front': 'Question (%s) %d.%d' %
+                                     (lang, file_idx, note_idx)})
+                    for lang in langs)
+            notes.append(note)
+        with open(os.path.join(directory, rel_dir, 'data.yaml'), 'w') as f:
+            f.write(util.toYaml(dict(notes=notes)))
+    return directory
@@ -0,0 +1,325 @@
+import hashlib
+import html
+import json
+import os
+import os.path
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+# Anki collection schema version 11, as read by every Anki 2.1 release.
+SCHEMA_VERSION = 11
+SCHEMA = '''
+CREATE TABLE col (
+    id              integer primary key,
+    crt             integer not null,
+    mod             integer not null,
+    scm             integer not null,
+    ver             integer not null,
+    dty             integer not null,
+    usn             integer not null,
+    ls              integer not null,
+    conf            text not null,
+    models          text not null,
+    decks           text not null,
+    dconf           text not null,
+    tags            text not null
+);
+CREATE TABLE notes (
+    id              integer primary key,
+    guid            text not null,
+    mid             integer not null,
+    mod             integer not null,
+    usn             integer not null,
+    tags            text not null,
+    flds            text not null,
+    sfld            integer not null,
+    csum            integer not null,
+    flags           integer not null,
+    data            text not null
+);
+CREATE TABLE cards (
+    id              integer primary key,
+    nid             integer not null,
+    did             integer not null,
+    ord             integer not null,
+    mod             integer not null,
+    usn             integer not null,
+    type            integer not null,
+    queue           integer not null,
+    due             integer not null,
+    ivl             integer not null,
+    factor          integer not null,
+    reps            integer not null,
+    lapses          integer not null,
+    left            integer not null,
+    odue            integer not null,
+    odid            integer not null,
+    flags           integer not null,
+    data            text not null
+);
+CREATE TABLE revlog (
+    id              integer primary key,
+    cid             integer not null,
+    usn             integer not null,
+    ease            integer not null,
+    ivl             integer not null,
+    lastIvl         integer not null,
+    factor          integer not null,
+    time            integer not null,
+    type            integer not null
+);
+CREATE TABLE graves (
+    usn             integer not null,
+    oid             integer not null,
+    type            integer not null
+);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+'''
+
+MODEL_TYPE_CLOZE = 1
+DEFAULT_LATEX_PRE = ('\\documentclass[12pt]{article}\n'
+                     '\\special{papersize=3in,5in}\n'
+                     '\\usepackage[utf8]{inputenc}\n'
+                     '\\usepackage{amssymb,amsmath}\n'
+                     '\\pagestyle{empty}\n'
+                     '\\setlength{\\parindent}{0in}\n'
+                     '\\begin{document}\n')
+DEFAULT_LATEX_POST = '\\end{document}'
+DEFAULT_DECK_CONFIG = {
+    'maxTaken': 60,
+    'autoplay': True,
+    'timer': 0,
+    'replayq': True,
+    'dyn': False,
+    'new': {
+        'bury': True,
+        'delays': [1, 10],
+        'initialFactor': 2500,
+        'ints': [1, 4, 7],
+        'order': 1,
+        'perDay': 20,
+        'separate': True
+    },
+    'rev': {
+        'bury': True,
+        'ease4': 1.3,
+        'fuzz': 0.05,
+        'ivlFct': 1,
+        'maxIvl': 36500,
+        'minSpace': 1,
+        'perDay': 100
+    },
+    'lapse': {
+        'delays': [10],
+        'leechAction': 0,
+        'leechFails': 8,
+        'minInt': 1,
+        'mult': 0
+    }
+}
+
+FIELD_REF_RE = re.compile(r'{{([^}]+)}}')
+CLOZE_RE = re.compile(r'{{c(\d+)::')
+HTML_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def _stableId(uuid):
+    # Anki matches note types and decks on import by id, so ids derived from
+    # the crowdanki uuids keep repeated imports from duplicating them.
+    digest = hashlib.sha1(uuid.encode('utf-8')).hexdigest()
+    return int(digest[:12], 16)
+
+
+def _stripHtml(value):
+    return html.unescape(HTML_TAG_RE.sub('', value)).strip()
+
+
+def _fieldChecksum(value):
+    digest = hashlib.sha1(_stripHtml(value).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16)
+
+
+def _templateFields(qfmt, field_ords):
+    ords = []
+    for match in FIELD_REF_RE.finditer(qfmt):
+        name = match.group(1).split(':')[-1].strip().lstrip('#^/')
+        if name in field_ords and field_ords[name] not in ords:
+            ords.append(field_ords[name])
+    return ords
+
+
+def _ankiModel(note_model, model_id, deck_id, now):
+    model = dict((key, value) for key, value in note_model.items()
+                 if key not in ('__type__', 'crowdanki_uuid'))
+    field_ords = dict((field['name'], field['ord']) for field in model['flds'])
+    model.update(id=model_id,
+                 mod=now,
+                 usn=-1,
+                 did=deck_id,
+                 sortf=model.get('sortf') or 0,
+                 type=model.get('type') or 0,
+                 latexPre=model.get('latexPre') or DEFAULT_LATEX_PRE,
+                 latexPost=model.get('latexPost') or DEFAULT_LATEX_POST,
+                 tags=model.get('tags') or [],
+                 vers=model.get('vers') or [])
+    model['req'] = [[
+        template['ord'], 'any',
+        _templateFields(template['qfmt'], field_ords)
+    ] for template in model['tmpls']]
+    return model
+
+
+def _cardOrds(model, fields):
+    if model['type'] == MODEL_TYPE_CLOZE:
+        ords = sorted(
+            set(int(num) - 1 for value in fields
+                for num in CLOZE_RE.findall(value) if int(num) > 0))
+    else:
+        ords = [
+            template_ord for template_ord, _, field_ords in model['req']
+            if any(fields[i].strip() for i in field_ords if i < len(fields))
+        ]
+    return ords or [0]
+
+
+def _deckConfig(deck_data, dconf_id, now):
+    config = json.loads(json.dumps(DEFAULT_DECK_CONFIG))
+    source = deck_data['deck_configurations'][0]
+    for key, value in source.items():
+        if key in ('__type__', 'crowdanki_uuid'):
+            continue
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    config.update(id=dconf_id, mod=now, usn=-1)
+    return config
+
+
+def _deck(deck_data, deck_id, dconf_id, now):
+    return {
+        'id': deck_id,
+        'name': deck_data['name'],
+        'desc': deck_data.get('desc') or '',
+        'mod': now,
+        'usn': -1,
+        'conf': dconf_id,
+        'dyn': 0,
+        'collapsed': False,
+        'browserCollapsed': False,
+        'extendNew': deck_data.get('extendNew', 10),
+        'extendRev': deck_data.get('extendRev', 50),
+        'newToday': [0, 0],
+        'revToday': [0, 0],
+        'lrnToday': [0, 0],
+        'timeToday': [0, 0]
+    }
+
+
+def _defaultDeck(now):
+    return _deck(dict(name='Default'), 1, 1, now)
+
+
+def _writeCollection(db_path, deck_data, note_models):
+    now = int(time.time())
+    now_ms = int(time.time() * 1000)
+    deck_id = _stableId(deck_data['crowdanki_uuid'])
+    dconf_id = _stableId(deck_data['deck_config_uuid'])
+
+    models = dict()
+    model_ids = dict()
+    for note_model in note_models:
+        model_id = _stableId(note_model['crowdanki_uuid'])
+        model_ids[note_model['crowdanki_uuid']] = model_id
+        models[str(model_id)] = _ankiModel(note_model, model_id, deck_id, now)
+
+    notes_rows = []
+    cards_rows = []
+    for position, note in enumerate(deck_data['notes']):
+        model_id = model_ids[note['note_model_uuid']]
+        model = models[str(model_id)]
+        fields = ['' if value is None else str(value) for value in note['fields']]
+        note_id = now_ms + position
+        sort_field = fields[model['sortf']] if model['sortf'] < len(fields) else ''
+        tags = ' %s ' % ' '.join(note['tags']) if note['tags'] else ''
+        notes_rows.append(
+            (note_id, note['guid'], model_id, now, -1, tags, '\x1f'.join(fields),
+             _stripHtml(sort_field), _fieldChecksum(fields[0] if fields else ''),
+             0, ''))
+        for card_ord in _cardOrds(model, fields):
+            cards_rows.append(
+                (now_ms + len(cards_rows), note_id, deck_id, card_ord, now, -1,
+                 0, 0, position + 1, 0, 0, 0, 0, 0, 0, 0, 0, ''))
+
+    decks = {'1': _defaultDeck(now)}
+    decks[str(deck_id)] = _deck(deck_data, deck_id, dconf_id, now)
+    dconf = {'1': dict(DEFAULT_DECK_CONFIG, id=1, name='Default', mod=now, usn=-1)}
+    dconf[str(dconf_id)] = _deckConfig(deck_data, dconf_id, now)
+    conf = {
+        'nextPos': len(deck_data['notes']) + 1,
+        'estTimes': True,
+        'activeDecks': [deck_id],
+        'sortType': 'noteFld',
+        'timeLim': 0,
+        'sortBackwards': False,
+        'addToCur': True,
+        'curDeck': deck_id,
+        'newBury': True,
+        'newSpread': 0,
+        'dueCounts': True,
+        'curModel': next(iter(model_ids.values()), None),
+        'collapseTime': 1200
+    }
+
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.execute(
+                'INSERT INTO col VALUES (1, ?, ?, ?, ?, 0, 0, 0, ?, ?, ?, ?, ?)',
+                (now, now_ms, now_ms, SCHEMA_VERSION, json.dumps(conf),
+                 json.dumps(models), json.dumps(decks), json.dumps(dconf),
+                 json.dumps({})))
+            connection.executemany(
+                'INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                notes_rows)
+            connection.executemany(
+                'INSERT INTO cards VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                cards_rows)
+    finally:
+        connection.close()
+
+    return dict(note_count=len(notes_rows), card_count=len(cards_rows))
+
+
+def writeApkg(path, deck_data, note_models, media_dir):
+    fd, db_path = tempfile.mkstemp(suffix='.anki2',
+                                   dir=os.path.dirname(path) or None)
+    os.close(fd)
+    os.remove(db_path)
+    try:
+        result = _writeCollection(db_path, deck_data, note_models)
+        media_map = dict()
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+            package.write(db_path, 'collection.anki2')
+            for i, media_file in enumerate(deck_data['media_files']):
+                package.write(os.path.join(media_dir, media_file), str(i),
+                              compress_type=zipfile.ZIP_STORED)
+                media_map[str(i)] = media_file
+            package.writestr('media', json.dumps(media_map))
+    finally:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+    return result
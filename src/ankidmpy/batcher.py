@@ -0,0 +1,113 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+import glob
+import os
+import os.path
+import time
+import traceback
+
+DEFAULT_BUILD_LOG = 'build.log'
+
+
+def _findDeckSets(patterns):
+    found = dict()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        if not matches:
+            util.warn("No directories match '%s'." % (pattern,))
+        for match in sorted(matches):
+            if not os.path.isdir(match):
+                continue
+            for directory, dirnames, filenames in os.walk(match):
+                if builder.DEFAULT_ANKIDM_CONFIG in filenames:
+                    found.setdefault(os.path.realpath(directory), directory)
+                    # A deck set never nests another one.
+                    dirnames[:] = []
+                else:
+                    dirnames[:] = sorted(name for name in dirnames
+                                         if not name.startswith('.'))
+    return [found[key] for key in sorted(found)]
+
+
+def _setBuildDirs(deck_sets, build_dir):
+    if build_dir is None:
+        return [os.path.join(deck_set, 'build') for deck_set in deck_sets]
+    names = [os.path.basename(os.path.realpath(deck_set)) for deck_set in deck_sets]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        util.err("Deck sets share a directory name and cannot be built into "
+                 "one --build directory: %s" % (', '.join(duplicates),))
+    return [os.path.join(build_dir, name) for name in names]
+
+
+def _buildDeckSet(deck_set, build_dir, lang, output_format, incremental):
+    util.prepareDir(build_dir)
+    log_path = os.path.join(build_dir, DEFAULT_BUILD_LOG)
+    start = time.perf_counter()
+    error = None
+    with open(log_path, 'w') as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            builder.build(None,
+                          deck_set,
+                          build_dir,
+                          lang,
+                          output_format=output_format,
+                          incremental=incremental)
+        except Exception as ex:
+            traceback.print_exc(file=log)
+            error = str(ex) or ex.__class__.__name__
+    return dict(deck_set=deck_set,
+                log=log_path,
+                error=error,
+                seconds=time.perf_counter() - start)
+
+
+def buildAll(patterns,
+             build_dir=None,
+             lang=None,
+             output_format='crowdanki',
+             jobs=None,
+             incremental=False):
+    deck_sets = _findDeckSets(patterns)
+    if not deck_sets:
+        util.err("No deck sets (directories with %s) found." %
+                 (builder.DEFAULT_ANKIDM_CONFIG,))
+    build_dirs = _setBuildDirs(deck_sets, build_dir)
+
+    start = time.perf_counter()
+    args = [(deck_set, set_build_dir, lang, output_format, incremental)
+            for deck_set, set_build_dir in zip(deck_sets, build_dirs)]
+    jobs = min(jobs or os.cpu_count() or 1, len(deck_sets))
+    results = []
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_buildDeckSet, *arg) for arg in args]
+            for arg, future in zip(args, futures):
+                try:
+                    results.append(future.result())
+                except Exception as ex:
+                    # The worker itself died; the build never reported back.
+                    results.append(
+                        dict(deck_set=arg[0],
+                             log=os.path.join(arg[1], DEFAULT_BUILD_LOG),
+                             error=str(ex) or ex.__class__.__name__,
+                             seconds=0.0))
+    else:
+        results = [_buildDeckSet(*arg) for arg in args]
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if result['error'] is not None]
+    for result in results:
+        util.msg("%-6s %8.2fs  %s  (log: %s)" %
+                 ('FAILED' if result['error'] is not None else 'OK',
+                  result['seconds'], result['deck_set'], result['log']))
+        if result['error'] is not None:
+            util.msg("       %s" % (result['error'].splitlines()[0],))
+    util.msg("Built %d of %d deck set(s) in %.2fs (%.2fs of build time, %d "
+             "worker(s))." % (len(results) - len(failed), len(results),
+                              elapsed, sum(r['seconds'] for r in results),
+                              jobs))
+    if failed:
+        util.err("%d deck set(s) failed to build." % (len(failed),))
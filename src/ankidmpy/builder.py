@@ -1,13 +1,34 @@
+import ankidmpy.apkg as apkg
+import ankidmpy.memprofile as memprofile
+import ankidmpy.minifier as minifier
 import ankidmpy.util as util
+from concurrent.futures import ThreadPoolExecutor
+import collections
 import fnmatch
 import glob
 import hashlib
+import io
+import json
 import os
 import re
 import shutil
 
 DEFAULT_ANKIDM_CONFIG = 'ankidm.yaml'
 DEFAULT_GUID_MAP_FILE = 'guid-map.yaml'
+DEFAULT_FINGERPRINTS_FILE = 'guid-fingerprints.json'
+DEFAULT_BUILD_MANIFEST = 'manifest.json'
+DEFAULT_BUILD_CACHE_DIR = '.cache'
+DEFAULT_PREVIEW_DIR = 'preview'
+DEFAULT_PARSE_CACHE_DIR = os.path.join('.cache', 'notes')
+DEFAULT_GIT_STATE_FILE = 'git-state.json'
+DEFAULT_GUID_SET_FILE = os.path.join('.cache', 'guid-set.txt')
+GUID_MAP_HEADER = 'guids:\n'
+OUTPUT_FORMATS = ('crowdanki', 'apkg')
+READ_AHEAD_DEPTH = 64
+IO_WORKERS = 4
+IO_QUEUE_DEPTH = 64
+MODEL_UUID_PLACEHOLDER = '@@ankidm-model-uuid@@'
+MODEL_NAME_PLACEHOLDER = '@@ankidm-model-name@@'
 DEFAULT_CRAWL_INCLUDE = ['**/data.yaml']
 TAG_SANITIZE_RE = re.compile(r'[^0-9A-Za-z:_-]+')
 
@@ -167,7 +188,39 @@ def _matchesAny(path, patterns):
     return False
 
 
-def _findDataFiles(config):
+def _crawlRelPath(config, path):
+    rel_path = _normalizePathForMatch(
+        os.path.relpath(os.path.abspath(path), config['crawl_root']))
+    if rel_path == '..' or rel_path.startswith('../'):
+        return None
+    return rel_path
+
+
+def _findSubtrees(config, only):
+    crawl_root = config['crawl_root']
+    subtrees = set()
+    for pattern in only:
+        for path in glob.glob(os.path.join(crawl_root, pattern),
+                              recursive=True):
+            rel_path = _normalizePathForMatch(os.path.relpath(path, crawl_root))
+            if rel_path == '.':
+                return None
+            if not rel_path.startswith('../'):
+                subtrees.add(rel_path)
+    if not subtrees:
+        util.err("No paths under crawl.root match --only: %s" %
+                 (', '.join(only),))
+    return sorted(subtrees)
+
+
+def _inSubtrees(rel_path, subtrees):
+    for subtree in subtrees:
+        if rel_path == subtree or rel_path.startswith(subtree + '/'):
+            return True
+    return False
+
+
+def _findDataFiles(config, subtrees=None):
     crawl_root = config['crawl_root']
     include_patterns = config['crawl_include']
     exclude_patterns = config['crawl_exclude']
@@ -176,12 +229,29 @@ def _findDataFiles(config):
     known = set()
 
     for pattern in include_patterns:
-        full_pattern = os.path.join(crawl_root, pattern)
-        for path in glob.glob(full_pattern, recursive=True):
+        # Recursive patterns are only globbed inside the selected subtrees;
+        # anything else is globbed from the crawl root and filtered.
+        if subtrees is not None and pattern.startswith('**/'):
+            full_patterns = [
+                os.path.join(crawl_root, subtree, pattern)
+                for subtree in subtrees
+                if os.path.isdir(os.path.join(crawl_root, subtree))
+            ]
+            full_patterns.extend(
+                os.path.join(crawl_root, subtree) for subtree in subtrees
+                if os.path.isfile(os.path.join(crawl_root, subtree)) and
+                fnmatch.fnmatch('/' + subtree, '*/' + pattern[3:]))
+        else:
+            full_patterns = [os.path.join(crawl_root, pattern)]
+
+        for path in (path for full_pattern in full_patterns
+                     for path in glob.glob(full_pattern, recursive=True)):
             if not os.path.isfile(path):
                 continue
 
             rel_path = _normalizePathForMatch(os.path.relpath(path, crawl_root))
+            if subtrees is not None and not _inSubtrees(rel_path, subtrees):
+                continue
             if _matchesAny(rel_path, exclude_patterns):
                 continue
             if rel_path in known:
@@ -385,40 +455,342 @@ def _loadModels(src_dir):
     return models
 
 
-def _loadNotes(config):
+def _internMapping(mapping, strings):
+    # Field names repeat on every note, and so do blank or boilerplate field
+    # values; util.internValue leaves values seen once alone.
+    return dict((util.internString(strings, key),
+                 util.internValue(strings, value))
+                for key, value in mapping.items())
+
+
+def _internNote(note, strings):
+    if 'model' in note:
+        note['model'] = util.internString(strings, note['model'])
+
+    tags = note.get('tags')
+    if isinstance(tags, list):
+        note['tags'] = [util.internString(strings, tag) for tag in tags]
+    elif isinstance(tags, str):
+        note['tags'] = util.internString(strings, tags)
+
+    fields = note.get('fields')
+    if isinstance(fields, dict):
+        note['fields'] = _internMapping(fields, strings)
+
+    fields_by_lang = note.get('fields_by_lang')
+    if isinstance(fields_by_lang, dict):
+        note['fields_by_lang'] = dict(
+            (util.internString(strings, code),
+             _internMapping(localized, strings)
+             if isinstance(localized, dict) else localized)
+            for code, localized in fields_by_lang.items())
+    return note
+
+
+def _noteTags(note_entry, path_tags_config, path_tags_cache, strings):
+    tags = [
+        util.internString(strings, tag)
+        for tag in _normalizeTags(note_entry['note'].get('tags'))
+    ]
+    if not path_tags_config:
+        return tags
+
+    rel_dir = note_entry['source_rel_dir']
+    if rel_dir not in path_tags_cache:
+        path_tags_cache[rel_dir] = [
+            util.internString(strings, tag)
+            for tag in _deriveTagsFromPath(rel_dir, path_tags_config)
+        ]
+    return _mergeTags([tags, path_tags_cache[rel_dir]])
+
+
+def _parseCacheDir(config):
+    return os.path.join(os.path.dirname(config['config_path']),
+                        DEFAULT_PARSE_CACHE_DIR)
+
+
+def _gitPaths(output):
+    return [path for path in (output or '').split('\0') if path]
+
+
+def _gitDirtyPaths(toplevel):
+    dirty = util.runGit(toplevel, 'diff', '--name-only', '--no-renames', '-z',
+                        'HEAD', '--')
+    untracked = util.runGit(toplevel, 'ls-files', '--others',
+                            '--exclude-standard', '-z')
+    if dirty is None or untracked is None:
+        return None
+    return _gitPaths(dirty) + _gitPaths(untracked)
+
+
+def _gitChanges(config, rev):
+    # Real paths of files that may differ from what the parse cache holds,
+    # or None when git cannot tell or the cache may predate 'rev'.
+    toplevel = util.runGit(config['crawl_root'], 'rev-parse', '--show-toplevel')
+    if toplevel is None:
+        util.warn("git is not available or crawl.root is not in a git checkout;"
+                  " running a full parse.")
+        return None
+    toplevel = toplevel.strip()
+    commit = util.runGit(toplevel, 'rev-parse', '--verify', '--quiet',
+                         rev + '^{commit}')
+    if commit is None:
+        util.warn("Unknown git revision '%s'; running a full parse." % (rev,))
+        return None
+    commit = commit.strip()
+
+    state = _loadParseCache(
+        os.path.join(_parseCacheDir(config), DEFAULT_GIT_STATE_FILE))
+    if not isinstance(state.get('commit'), str) or util.runGit(
+            toplevel, 'merge-base', '--is-ancestor', commit,
+            state['commit']) is None:
+        util.warn("The parse cache predates '%s'; running a full parse." %
+                  (rev,))
+        return None
+
+    changed = util.runGit(toplevel, 'diff', '--name-only', '--no-renames',
+                          '-z', commit, '--')
+    untracked = util.runGit(toplevel, 'ls-files', '--others',
+                            '--exclude-standard', '-z')
+    if changed is None or untracked is None:
+        util.warn("Cannot list changes since '%s'; running a full parse." %
+                  (rev,))
+        return None
+    # Files that were dirty when the cache was recorded may hold content
+    # that never reached a commit.
+    paths = _gitPaths(changed) + _gitPaths(untracked) + list(
+        state.get('dirty') or [])
+    return set(
+        os.path.realpath(os.path.join(toplevel, path)) for path in paths)
+
+
+def _recordGitState(config):
+    toplevel = util.runGit(config['crawl_root'], 'rev-parse', '--show-toplevel')
+    if toplevel is None:
+        return
+    toplevel = toplevel.strip()
+    head = util.runGit(toplevel, 'rev-parse', '--verify', '--quiet', 'HEAD')
+    dirty = _gitDirtyPaths(toplevel)
+    if head is None or dirty is None:
+        return
+    crawl_root = os.path.realpath(config['crawl_root']) + os.sep
+    dirty = [
+        path for path in dirty
+        if os.path.realpath(os.path.join(toplevel, path)).startswith(crawl_root)
+    ]
+    cache_dir = _parseCacheDir(config)
+    util.prepareDir(cache_dir)
+    with open(os.path.join(cache_dir, DEFAULT_GIT_STATE_FILE), 'w') as f:
+        f.write(json.dumps(dict(commit=head.strip(), dirty=sorted(dirty))))
+
+
+def _isUnchanged(data_file, changed):
+    return changed is not None and \
+        os.path.realpath(data_file['path']) not in changed
+
+
+def _loadNotes(config,
+               strings=None,
+               subtrees=None,
+               pipelined=True,
+               profile=None,
+               incremental=False,
+               changed_since=None):
+    if strings is None:
+        strings = util.createStringTable()
+    parse_cache_dir = None
+    if incremental or changed_since:
+        parse_cache_dir = _parseCacheDir(config)
+
+    memprofile.beginPhase(profile, 'crawl')
+    data_files = _findDataFiles(config, subtrees)
+    changed = _gitChanges(config, changed_since) if changed_since else None
+
+    # Files git reports as unchanged come straight from the parse cache.
+    cached = dict()
+    for data_file in data_files:
+        if _isUnchanged(data_file, changed):
+            file_notes = _cachedNotes(data_file, parse_cache_dir)
+            if file_notes is not None:
+                cached[data_file['rel_path']] = file_notes
+    if changed_since:
+        util.msg("Reusing cached notes for %d of %d data file(s) unchanged "
+                 "since '%s'." % (len(cached), len(data_files), changed_since))
+
+    memprofile.beginPhase(profile, 'parse')
+    # JSON Lines files are streamed a line at a time instead of read ahead.
+    read_paths = [
+        data_file['path'] for data_file in data_files
+        if data_file['rel_path'] not in cached and
+        not util.isJsonl(data_file['path'])
+    ]
+    if pipelined:
+        contents = util.readAhead(read_paths, READ_AHEAD_DEPTH)
+    else:
+        contents = ((path, util.getRaw(path)) for path in read_paths)
+
+    notes = []
+    for data_file in data_files:
+        if data_file['rel_path'] in cached:
+            data = dict(notes=cached[data_file['rel_path']])
+        elif util.isJsonl(data_file['path']):
+            data = util.getNotes(data_file['path'])
+        else:
+            _, raw = next(contents)
+            data = _parseData(data_file, raw, parse_cache_dir)
+        notes.extend(_dataFileNotes(data_file, data, strings))
+    memprofile.endPhase(profile)
+
+    # A subset run leaves the cache entries of all other files as they were,
+    # so it must not claim them up to date.
+    if changed_since and subtrees is None:
+        _recordGitState(config)
+    return notes
+
+
+def _isJsonSafe(value):
+    if isinstance(value, dict):
+        return all(
+            isinstance(key, str) and _isJsonSafe(item)
+            for key, item in value.items())
+    if isinstance(value, list):
+        return all(_isJsonSafe(item) for item in value)
+    return value is None or isinstance(value, (str, int, float))
+
+
+def _loadParseCache(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        cache = util.getJson(path)
+    except ValueError:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _parseCachePath(cache_dir, data_file):
+    return os.path.join(
+        cache_dir,
+        hashlib.sha1(data_file['rel_path'].encode('utf-8')).hexdigest() +
+        '.json')
+
+
+def _fileStamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _cachedNotes(data_file, cache_dir):
+    # git only narrows down the candidates; an entry is served only while the
+    # file still has the size and mtime it had when the entry was written.
+    cache = _loadParseCache(_parseCachePath(cache_dir, data_file))
+    notes = cache.get('notes')
+    if not isinstance(notes, list) or \
+            cache.get('stamp') != _fileStamp(data_file['path']):
+        return None
+    return notes
+
+
+def _parseDataFileFully(data_file, raw, cache_path):
+    # A stale entry must not outlive the content it was made from.
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+    return util.parseYaml(data_file['path'], raw)
+
+
+def _parseDataFileIncremental(data_file, raw, cache_dir):
+    # Each top-level note item is parsed on its own and cached by the hash
+    # of its text, so an edit re-parses only the items it touched.
+    cache_path = _parseCachePath(cache_dir, data_file)
+    file_hash = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    stamp = _fileStamp(data_file['path'])
+    cache = _loadParseCache(cache_path)
+    if cache.get('file') == file_hash and isinstance(cache.get('notes'), list):
+        if cache.get('stamp') != stamp:
+            _writeParseCacheEntry(cache_path, dict(cache, stamp=stamp))
+        return dict(notes=cache['notes'])
+
+    chunks = util.splitYamlNotes(raw)
+    if chunks is None:
+        return _parseDataFileFully(data_file, raw, cache_path)
+
+    cached = dict(zip(cache.get('chunks') or [], cache.get('notes') or []))
+    chunk_hashes = []
     notes = []
-    for data_file in _findDataFiles(config):
-        data = util.getYaml(data_file['path'], required=True)
-        if not isinstance(data, dict):
-            util.err("File '%s' must contain a top-level object." %
-                     (data_file['path'],))
-
-        file_notes = data.get('notes')
-        if not isinstance(file_notes, list):
-            util.err("File '%s' must contain a 'notes' list." %
-                     (data_file['path'],))
-
-        for i, note in enumerate(file_notes):
-            if not isinstance(note, dict):
-                util.err("Invalid note at index %d in '%s'." %
-                         (i, data_file['path']))
-            notes.append(
-                dict(note=note,
-                     note_index=i,
-                     source_file=data_file['path'],
-                     source_rel_file=data_file['rel_path'],
-                     source_rel_dir=data_file['rel_dir']))
+    for chunk in chunks:
+        chunk_hash = hashlib.sha1(chunk.encode('utf-8')).hexdigest()
+        note = cached.get(chunk_hash)
+        if note is None:
+            note = util.parseYamlItem(chunk)
+            if not isinstance(note, dict) or not _isJsonSafe(note):
+                return _parseDataFileFully(data_file, raw, cache_path)
+        chunk_hashes.append(chunk_hash)
+        notes.append(note)
+
+    _writeParseCacheEntry(
+        cache_path,
+        dict(file=file_hash, stamp=stamp, chunks=chunk_hashes, notes=notes))
+    return dict(notes=notes)
+
+
+def _writeParseCacheEntry(cache_path, entry):
+    util.prepareDir(os.path.dirname(cache_path))
+    with open(cache_path, 'w') as f:
+        f.write(json.dumps(entry, ensure_ascii=False))
+
+
+def _parseData(data_file, raw, parse_cache_dir=None):
+    if parse_cache_dir is None or util.isJsonl(data_file['path']):
+        return util.parseNotes(data_file['path'], raw)
+    return _parseDataFileIncremental(data_file, raw, parse_cache_dir)
+
+
+def _readDataFile(data_file, parse_cache_dir=None):
+    if util.isJsonl(data_file['path']):
+        return util.getNotes(data_file['path'])
+    return _parseData(data_file, util.getRaw(data_file['path']),
+                      parse_cache_dir)
+
+
+def _dataFileNotes(data_file, data, strings):
+    if not isinstance(data, dict):
+        util.err("File '%s' must contain a top-level object." %
+                 (data_file['path'],))
+
+    file_notes = data.get('notes')
+    if not isinstance(file_notes, list):
+        util.err("File '%s' must contain a 'notes' list." %
+                 (data_file['path'],))
+
+    notes = []
+    for i, note in enumerate(file_notes):
+        if not isinstance(note, dict):
+            util.err("Invalid note at index %d in '%s'." %
+                     (i, data_file['path']))
+        notes.append(
+            dict(note=_internNote(note, strings),
+                 note_index=i,
+                 source_file=data_file['path'],
+                 source_rel_file=data_file['rel_path'],
+                 source_rel_dir=data_file['rel_dir']))
     return notes
 
 
-def loadCrawledNotes(config):
-    return _loadNotes(config)
+def loadCrawledNotes(config, strings=None, changed_since=None):
+    return _loadNotes(config, strings, changed_since=changed_since)
 
 
 def _noteRef(note_entry):
     return "%s#%d" % (note_entry['source_rel_file'], note_entry['note_index'])
 
 
+def _noteIdRef(note_entry):
+    note_id = note_entry['note'].get('id')
+    if isinstance(note_id, str) and note_id.strip():
+        return '%s#%s' % (note_entry['source_rel_file'], note_id.strip())
+    return _noteRef(note_entry)
+
+
 def _noteLanguages(note_entry):
     note = note_entry['note']
     fields_by_lang = note.get('fields_by_lang') or {}
@@ -437,10 +809,22 @@ def _noteLanguages(note_entry):
     return langs
 
 
-def _supportedLanguages(note_entries):
+def _buildLanguageIndex(note_entries):
+    # Maps each language code to the positions of the notes that carry
+    # non-empty overrides for it.
+    index = dict()
+    for position, note_entry in enumerate(note_entries):
+        fields_by_lang = note_entry['note'].get('fields_by_lang') or {}
+        for code in _noteLanguages(note_entry):
+            overlay = index.setdefault(code, set())
+            if fields_by_lang[code]:
+                overlay.add(position)
+    return index
+
+
+def _supportedLanguages(language_index):
     langs = {'default'}
-    for note_entry in note_entries:
-        langs.update(_noteLanguages(note_entry))
+    langs.update(language_index.keys())
     return sorted(langs)
 
 
@@ -451,16 +835,18 @@ def _fieldValuesForLang(note_entry, lang):
         util.err("Note '%s' is missing object field 'fields'." %
                  (_noteRef(note_entry),))
 
+    if lang == 'default':
+        return fields
+    fields_by_lang = note.get('fields_by_lang') or {}
+    localized = fields_by_lang.get(lang)
+    if not localized:
+        return fields
+    if not isinstance(localized, dict):
+        util.err(
+            "Localized fields for lang '%s' must be an object on note '%s'."
+            % (lang, _noteRef(note_entry)))
     resolved = dict(fields)
-    if lang != 'default':
-        fields_by_lang = note.get('fields_by_lang') or {}
-        localized = fields_by_lang.get(lang)
-        if localized:
-            if not isinstance(localized, dict):
-                util.err(
-                    "Localized fields for lang '%s' must be an object on note '%s'."
-                    % (lang, _noteRef(note_entry)))
-            resolved.update(localized)
+    resolved.update(localized)
     return resolved
 
 
@@ -531,6 +917,83 @@ def _noteModelInfo(model, model_uuid, model_name):
     return note_model
 
 
+def _minifiedModel(model, minify_state):
+    model = dict(model)
+    model['css'] = minifier.minify(minify_state, 'css', model.get('css') or '')
+    templates = []
+    for template in model['templates']:
+        template = dict(template)
+        for key in ('qfmt', 'afmt', 'bqfmt', 'bafmt'):
+            if isinstance(template.get(key), str):
+                template[key] = minifier.minify(minify_state, 'html',
+                                                template[key])
+        templates.append(template)
+    model['templates'] = templates
+    return model
+
+
+def _compileModelPlan(model, minify_state=None):
+    field_minify = None
+    if minify_state is not None:
+        if not minifier.keepsFieldWhitespace(model):
+            field_minify = minify_state
+        model = _minifiedModel(model, minify_state)
+    note_model = _noteModelInfo(model, MODEL_UUID_PLACEHOLDER,
+                                MODEL_NAME_PLACEHOLDER)
+    return dict(id=model['id'],
+                fields=list(model['fields']),
+                note_model_json=util.toJsonFragment(note_model, 2),
+                minify=field_minify)
+
+
+def _compileModelPlans(models, minify_state=None):
+    return dict((model_id, _compileModelPlan(model, minify_state))
+                for model_id, model in models.items())
+
+
+def _modelPlanJson(plan, model_uuid, model_name):
+    result = plan['note_model_json'].replace(
+        json.dumps(MODEL_UUID_PLACEHOLDER), json.dumps(model_uuid), 1)
+    return result.replace(json.dumps(MODEL_NAME_PLACEHOLDER),
+                          json.dumps(model_name, ensure_ascii=False), 1)
+
+
+def _planFieldValues(plan, fields_by_name, note_entry):
+    try:
+        return [fields_by_name[field_name] for field_name in plan['fields']]
+    except KeyError as ex:
+        util.err("Missing field '%s' in note '%s' for model '%s'." %
+                 (ex.args[0], _noteRef(note_entry), plan['id']))
+
+
+def _minifiedFieldValues(plan, values):
+    if plan['minify'] is None:
+        return values
+    return [
+        minifier.minify(plan['minify'], 'html', value)
+        if isinstance(value, str) else value for value in values
+    ]
+
+
+def _localizedNoteFields(note_entry, plan, media_files, lang):
+    fields = _minifiedFieldValues(
+        plan,
+        _planFieldValues(plan, _fieldValuesForLang(note_entry, lang),
+                         note_entry))
+    return fields, _collectDeckMedia(media_files, fields)
+
+
+def _defaultNoteFields(note_entry, plan, media_files):
+    # The default-language result is shared by every deck and by every
+    # language the note has no overrides for.
+    resolved = note_entry.get('default_fields')
+    if resolved is None:
+        resolved = _localizedNoteFields(note_entry, plan, media_files,
+                                        'default')
+        note_entry['default_fields'] = resolved
+    return resolved
+
+
 def _loadGuidMap(src_dir):
     guid_map_path = os.path.join(src_dir, DEFAULT_GUID_MAP_FILE)
     raw = util.getYaml(guid_map_path, required=False)
@@ -559,9 +1022,197 @@ def _loadGuidMap(src_dir):
 
 
 def _writeGuidMap(path, guid_map):
-    ordered = dict((key, guid_map[key]) for key in sorted(guid_map.keys()))
     with open(path, 'w') as f:
-        f.write(util.toYaml(dict(guids=ordered)))
+        util.writeYaml(f,
+                       dict(guids=((key, guid_map[key])
+                                   for key in sorted(guid_map))),
+                       'guids',
+                       pairs=True)
+    _writeGuidSet(path, guid_map.values())
+
+
+def _guidSetPath(guid_map_path):
+    return os.path.join(os.path.dirname(guid_map_path), DEFAULT_GUID_SET_FILE)
+
+
+def _guidMapStamp(guid_map_path):
+    stat = os.stat(guid_map_path)
+    return '%d %d' % (stat.st_size, stat.st_mtime_ns)
+
+
+def _writeGuidSet(guid_map_path, guids):
+    # One guid per line after a stamp of the guid map they were taken from.
+    path = _guidSetPath(guid_map_path)
+    util.prepareDir(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(_guidMapStamp(guid_map_path) + '\n')
+        for guid in sorted(set(guids)):
+            f.write(guid + '\n')
+
+
+def _loadGuidSet(guid_map_path):
+    # The guids in use, rebuilt from the guid map when it was written by
+    # anything that did not also refresh the set.
+    if not os.path.exists(guid_map_path):
+        return set()
+    path = _guidSetPath(guid_map_path)
+    if os.path.exists(path):
+        lines = util.getRaw(path).split('\n')
+        if lines[0] == _guidMapStamp(guid_map_path):
+            return set(lines[1:-1])
+    guid_map, _ = _loadGuidMap(os.path.dirname(guid_map_path))
+    guids = set(guid_map.values())
+    _writeGuidSet(guid_map_path, guids)
+    return guids
+
+
+def _guidMapEntryKey(lines):
+    line = lines[0]
+    sep = line.find(': ')
+    if len(lines) == 1 and sep > 2 and line[2] not in '\'"?&*!|>%@`{[-#':
+        return line[2:sep]
+    try:
+        entry = util.parseYaml('<guid-map entry>', ''.join(lines))
+    except RuntimeError:
+        return None
+    if not isinstance(entry, dict) or len(entry) != 1:
+        return None
+    key = next(iter(entry))
+    return key if isinstance(key, str) else None
+
+
+def _readGuidMapEntries(path):
+    # (key, text) of every entry of a guid map laid out the way _writeGuidMap
+    # writes it, without loading the whole map; None for any other layout.
+    if not os.path.exists(path):
+        return []
+    lines = util.getRaw(path).splitlines(True)
+    if lines == ['guids: {}\n']:
+        return []
+    if not lines or lines[0] != GUID_MAP_HEADER:
+        return None
+
+    groups = []
+    for line in lines[1:]:
+        if line.startswith('   ') or line.startswith('  : '):
+            # Continuation of a wrapped or complex ('? ') key.
+            if not groups:
+                return None
+            groups[-1].append(line)
+        elif line.startswith('  ') and line[2:3].strip():
+            groups.append([line])
+        else:
+            return None
+
+    entries = []
+    for group in groups:
+        key = _guidMapEntryKey(group)
+        if key is None:
+            return None
+        entries.append((key, ''.join(group)))
+    return entries
+
+
+def _guidMapEntryText(key, guid):
+    f = io.StringIO()
+    util.writeYaml(f, dict(guids=[(key, guid)]), 'guids', pairs=True)
+    return f.getvalue()[len(GUID_MAP_HEADER):]
+
+
+def _guidMapEntryValue(key, text, guid_map_path):
+    value = util.parseYaml(guid_map_path, text).get(key)
+    if not isinstance(value, str) or not value.strip():
+        util.err("Invalid guid-map value for key '%s' in '%s'." %
+                 (key, guid_map_path))
+    return value.strip()
+
+
+def _writeGuidMapEntries(path, entries):
+    with open(path, 'w') as f:
+        if not entries:
+            f.write(util.toYaml(dict(guids={})))
+            return
+        f.write(GUID_MAP_HEADER)
+        for _, text in entries:
+            f.write(text)
+
+
+def _noteFingerprint(fields_by_name, field_names, tags):
+    parts = []
+    for field_name in sorted(field_names):
+        value = fields_by_name.get(field_name)
+        parts.append('%s\x1f%s' % (field_name, '' if value is None else value))
+    parts.append('\x1e')
+    parts.extend(sorted(tags))
+    payload = '\x1e'.join(parts)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def _loadFingerprints(src_dir):
+    path = os.path.join(src_dir, DEFAULT_FINGERPRINTS_FILE)
+    if not os.path.exists(path):
+        return {}, path
+    data = util.getJson(path)
+    if not isinstance(data, dict):
+        util.warn("Ignoring invalid fingerprints file: %s" % (path,))
+        return {}, path
+    return data, path
+
+
+def _writeFingerprints(path, fingerprints):
+    with open(path, 'w') as f:
+        f.write(json.dumps(fingerprints, sort_keys=True, indent=0))
+
+
+def _fingerprintKey(guid, lang):
+    # Guids never contain spaces.
+    return guid if lang == 'default' else '%s %s' % (guid, lang)
+
+
+def _dropFingerprints(fingerprints, guids):
+    for key in list(fingerprints):
+        if key.split(' ', 1)[0] in guids:
+            del fingerprints[key]
+
+
+def _builtFieldValues(fields, plan):
+    # Fingerprints match what an export of the built deck holds.
+    if plan is None or plan['minify'] is None:
+        return fields
+    return dict(
+        (name, minifier.minify(plan['minify'], 'html', value)
+         if isinstance(value, str) else value)
+        for name, value in fields.items())
+
+
+def _recordFingerprints(note_entries,
+                        models,
+                        src_dir,
+                        language_index=None,
+                        model_plans=None):
+    fingerprints, path = _loadFingerprints(src_dir)
+    next_fingerprints = dict()
+    for position, note_entry in enumerate(note_entries):
+        note = note_entry['note']
+        model = models.get(note.get('model'))
+        fields = note.get('fields')
+        if model is None or not isinstance(fields, dict):
+            continue
+        plan = (model_plans or {}).get(note.get('model'))
+        tags = _normalizeTags(note.get('tags'))
+        next_fingerprints[note_entry['guid']] = _noteFingerprint(
+            _builtFieldValues(fields, plan), model['fields'], tags)
+        # Localized decks show the default fields unless a note overrides
+        # them, so only overriding notes need a fingerprint of their own.
+        for lang, positions in (language_index or {}).items():
+            if position in positions:
+                next_fingerprints[_fingerprintKey(
+                    note_entry['guid'], lang)] = _noteFingerprint(
+                        _builtFieldValues(_fieldValuesForLang(note_entry, lang),
+                                          plan), model['fields'], tags)
+
+    if next_fingerprints != fingerprints:
+        _writeFingerprints(path, next_fingerprints)
 
 
 def _deterministicGuidForKey(key, salt=0):
@@ -601,17 +1252,12 @@ def _noteGuidKey(note_entry):
     return 'idx:%s#%d' % (note_entry['source_rel_file'], note_entry['note_index'])
 
 
-def _assignNoteGuids(note_entries, src_dir, full=False):
-    guid_map, guid_map_path = _loadGuidMap(src_dir)
-    used_guids = set()
-    discovered_keys = set()
-    next_guid_map = dict()
-
+def _nextNoteGuids(note_entries, guid_map, used_guids, full):
+    next_guids = dict()
     for note_entry in note_entries:
         key = _noteGuidKey(note_entry)
-        if key in discovered_keys:
+        if key in next_guids:
             util.err("Duplicate note identity key found: %s" % (key,))
-        discovered_keys.add(key)
 
         existing_guid = guid_map.get(key)
         if (not full and isinstance(existing_guid, str) and existing_guid
@@ -621,9 +1267,12 @@ def _assignNoteGuids(note_entries, src_dir, full=False):
             guid = _deterministicUniqueGuidForKey(key, used_guids)
 
         used_guids.add(guid)
-        next_guid_map[key] = guid
+        next_guids[key] = guid
         note_entry['guid'] = guid
+    return next_guids
+
 
+def _guidMapChanges(guid_map, next_guid_map, guid_map_path):
     prev_keys = set(guid_map.keys())
     next_keys = set(next_guid_map.keys())
     added = sorted(next_keys - prev_keys)
@@ -632,12 +1281,7 @@ def _assignNoteGuids(note_entries, src_dir, full=False):
         key for key in (next_keys & prev_keys)
         if guid_map.get(key) != next_guid_map.get(key)
     ])
-
-    changed = next_guid_map != guid_map
-    if changed:
-        _writeGuidMap(guid_map_path, next_guid_map)
-
-    return dict(changed=changed,
+    return dict(changed=next_guid_map != guid_map,
                 path=guid_map_path,
                 added_count=len(added),
                 removed_count=len(removed),
@@ -645,14 +1289,247 @@ def _assignNoteGuids(note_entries, src_dir, full=False):
                 removed_examples=removed[:5])
 
 
+def _assignNoteGuids(note_entries, src_dir, full=False, prune=True):
+    guid_map, guid_map_path = _loadGuidMap(src_dir)
+    used_guids = set()
+    next_guid_map = dict()
+
+    if not prune:
+        # Keep entries of notes that were not crawled in this run, and never
+        # hand out their guids to crawled notes.
+        crawled_keys = set(_noteGuidKey(note_entry) for note_entry in note_entries)
+        for key, guid in guid_map.items():
+            if key not in crawled_keys:
+                next_guid_map[key] = guid
+                used_guids.add(guid)
+
+    next_guid_map.update(
+        _nextNoteGuids(note_entries, guid_map, used_guids, full))
+
+    result = _guidMapChanges(guid_map, next_guid_map, guid_map_path)
+    if result['changed']:
+        _writeGuidMap(guid_map_path, next_guid_map)
+    return result
+
+
 def reindexGuidMap(note_entries, src_dir, full=False):
     return _assignNoteGuids(note_entries, src_dir, full=full)
 
 
-def build(decks, src_dir, build_dir, lang):
+def _isCrawledPath(config, rel_path):
+    if _matchesAny(rel_path, config['crawl_exclude']):
+        return False
+    for pattern in config['crawl_include']:
+        if pattern.startswith('**/') and fnmatch.fnmatch(
+                '/' + rel_path, '*/' + pattern[3:]):
+            return True
+        if fnmatch.fnmatch(rel_path, pattern):
+            return True
+    return False
+
+
+def reindexGuidMapFiles(config, paths, src_dir, full=False):
+    # Refresh the guid-map entries of the given note files only.  Entries of
+    # other files are copied as text, and new guids are checked against the
+    # guid set kept next to the map, so the cost does not grow with the
+    # number of notes elsewhere in the deck set.
+    guid_map_path = os.path.join(src_dir, DEFAULT_GUID_MAP_FILE)
+    entries = _readGuidMapEntries(guid_map_path)
+    if entries is None:
+        # Hand-edited layout: rewrite the map once the way _writeGuidMap does.
+        guid_map, _ = _loadGuidMap(src_dir)
+        _writeGuidMap(guid_map_path, guid_map)
+        entries = _readGuidMapEntries(guid_map_path)
+
+    data_files = []
+    prefixes = []
+    for path in paths:
+        rel_path = _crawlRelPath(config, path)
+        if rel_path is None:
+            util.err("'%s' is not under crawl.root." % (path,))
+        exists = os.path.isfile(path)
+        if exists and not _isCrawledPath(config, rel_path):
+            util.warn("Skipping '%s': not matched by crawl.include in %s." %
+                      (path, DEFAULT_ANKIDM_CONFIG))
+            continue
+        # A path that no longer exists drops the entries of its notes.
+        prefixes.extend(('id:%s#' % (rel_path,), 'idx:%s#' % (rel_path,)))
+        if exists:
+            rel_dir = _normalizePathForMatch(os.path.dirname(rel_path))
+            data_files.append(
+                dict(path=path,
+                     rel_path=rel_path,
+                     rel_dir='' if rel_dir == '.' else rel_dir))
+
+    prefixes = tuple(prefixes)
+    guid_map = dict()
+    kept = []
+    for key, text in entries:
+        if key.startswith(prefixes):
+            guid_map[key] = _guidMapEntryValue(key, text, guid_map_path)
+        else:
+            kept.append((key, text))
+
+    strings = util.createStringTable()
+    note_entries = []
+    for data_file in data_files:
+        data = _readDataFile(data_file)
+        note_entries.extend(_dataFileNotes(data_file, data, strings))
+
+    used_guids = _loadGuidSet(guid_map_path) - set(guid_map.values())
+    next_guid_map = _nextNoteGuids(note_entries, guid_map, used_guids, full)
+
+    result = _guidMapChanges(guid_map, next_guid_map, guid_map_path)
+    if result['changed']:
+        kept.extend((key, _guidMapEntryText(key, guid))
+                    for key, guid in next_guid_map.items())
+        kept.sort(key=lambda entry: entry[0])
+        _writeGuidMapEntries(guid_map_path, kept)
+        _writeGuidSet(guid_map_path, used_guids)
+    return result
+
+
+def _hashJson(data):
+    payload = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _hashPart(value):
+    if isinstance(value, str):
+        return 's' + value
+    return 'j' + json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def _noteHash(note):
+    parts = [note['guid'], note['note_model_uuid'], '\x1e']
+    parts.extend(_hashPart(value) for value in note['fields'])
+    parts.append('\x1e')
+    parts.extend(note['tags'])
+    payload = '\x1f'.join(parts)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _loadFragmentCache(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        cache = util.getJson(path)
+    except ValueError:
+        util.warn("Ignoring unreadable fragment cache: %s" % (path,))
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _writeFragmentCache(path, cache):
+    util.prepareDir(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(json.dumps(cache, ensure_ascii=False))
+
+
+def _serializeDeck(deck_data, model_sections, note_hashes, cache_path):
+    cache = _loadFragmentCache(cache_path)
+    next_cache = dict()
+    fragments = []
+    for note in deck_data['notes']:
+        note_hash = note_hashes[note['guid']]
+        fragment = cache.get(note_hash)
+        if fragment is None:
+            fragment = util.toJsonFragment(note, 2)
+        next_cache[note_hash] = fragment
+        fragments.append(fragment)
+
+    for note_hash in note_hashes.values():
+        if note_hash not in next_cache and note_hash in cache:
+            next_cache[note_hash] = cache[note_hash]
+    if next_cache != cache:
+        _writeFragmentCache(cache_path, next_cache)
+
+    return util.toJsonSpliced(
+        deck_data,
+        dict(note_models=[section['json'] for section in model_sections],
+             notes=fragments))
+
+
+def _loadBuildManifest(path):
+    raw = util.getJson(path, required=True)
+    if not isinstance(raw, dict) or not isinstance(raw.get('outputs'), dict):
+        util.err("File '%s' is not a build manifest." % (path,))
+    return raw
+
+
+def _writeBuildManifest(path, manifest):
+    with open(path, 'w') as f:
+        f.write(util.toJson(manifest))
+
+
+def _outputManifest(deck_data, model_sections, deck_notes):
+    header = dict((key, value) for key, value in deck_data.items()
+                  if key not in ('note_models', 'notes', 'media_files'))
+    return dict(header=_hashJson(header),
+                models=_hashJson([section['json'] for section in model_sections]),
+                notes=dict((note['guid'], _noteHash(note))
+                           for note in deck_notes))
+
+
+def _deltaOutput(deck_data, model_sections, deck_notes, notes_media,
+                 output_manifest, prev_manifest):
+    prev_notes = prev_manifest.get('notes') or {}
+    models_changed = output_manifest['models'] != prev_manifest.get('models')
+
+    delta_notes = []
+    delta_media = []
+    seen_media = set()
+    for note, note_media in zip(deck_notes, notes_media):
+        if prev_notes.get(note['guid']) == output_manifest['notes'][note['guid']]:
+            continue
+        delta_notes.append(note)
+        for media_file in note_media:
+            if media_file not in seen_media:
+                seen_media.add(media_file)
+                delta_media.append(media_file)
+
+    used_models = set(note['note_model_uuid'] for note in delta_notes)
+    deck_data['media_files'] = delta_media
+    deck_data['notes'] = delta_notes
+
+    removed = set(prev_notes.keys()) - set(output_manifest['notes'].keys())
+    return dict(model_sections=[
+        section for section in model_sections
+        if models_changed or section['uuid'] in used_models
+    ],
+                changed_count=len(delta_notes),
+                removed_count=len(removed),
+                models_changed=models_changed,
+                header_changed=output_manifest['header'] !=
+                prev_manifest.get('header'))
+
+
+def build(decks,
+          src_dir,
+          build_dir,
+          lang,
+          delta_since=None,
+          only=None,
+          pipelined=True,
+          profile=None,
+          output_format='crowdanki',
+          incremental=False,
+          changed_since=None,
+          minify=False):
+    if only and delta_since:
+        util.err("--only cannot be combined with --delta-since.")
+    if output_format not in OUTPUT_FORMATS:
+        util.err("Unknown output format '%s'." % (output_format,))
+
     ankidm_config = _loadAnkiDmConfig(src_dir)
-    notes = _loadNotes(ankidm_config)
-    guid_update = _assignNoteGuids(notes, src_dir, full=False)
+    subtrees = _findSubtrees(ankidm_config, only) if only else None
+    strings = util.createStringTable()
+    notes = _loadNotes(ankidm_config, strings, subtrees, pipelined, profile,
+                       incremental, changed_since)
+    memprofile.beginPhase(profile, 'guids')
+    guid_update = _assignNoteGuids(notes, src_dir, full=False,
+                                   prune=subtrees is None)
+    memprofile.endPhase(profile)
     if guid_update['changed']:
         util.msg("Updated guid map: %s (added: %d, removed: %d, reassigned: %d)"
                  % (os.path.basename(guid_update['path']),
@@ -671,8 +1548,13 @@ def build(decks, src_dir, build_dir, lang):
                   notes=notes)
 
     path_tags_config = ankidm_config['path_tags']
+    path_tags_cache = dict()
+    for note_entry in notes:
+        note_entry['tags'] = _noteTags(note_entry, path_tags_config,
+                                       path_tags_cache, strings)
 
-    languages = _supportedLanguages(glbals['notes'])
+    language_index = _buildLanguageIndex(notes)
+    languages = _supportedLanguages(language_index)
     if lang:
         if lang not in languages:
             util.err("Language '%s' is not available." % (lang,))
@@ -680,9 +1562,38 @@ def build(decks, src_dir, build_dir, lang):
 
     decks_build = _readDecks(decks, os.path.join(src_dir, 'decks'))
 
+    target_build_dir = build_dir or 'build'
+    if subtrees is not None:
+        # Preview decks of a subset never replace the full outputs or the
+        # state recorded for them.
+        target_build_dir = os.path.join(target_build_dir, DEFAULT_PREVIEW_DIR)
+        util.msg("Building preview of %d note(s) from: %s" %
+                 (len(notes), ', '.join(subtrees)))
+    minify_state = None
+    if minify:
+        minify_state = minifier.openCache(
+            os.path.join(target_build_dir, DEFAULT_BUILD_CACHE_DIR,
+                         minifier.DEFAULT_MINIFY_CACHE))
+    model_plans = _compileModelPlans(glbals['models'], minify_state)
+
+    manifest_path = os.path.join(target_build_dir, DEFAULT_BUILD_MANIFEST)
+    prev_outputs = dict()
+    if delta_since:
+        prev_outputs = _loadBuildManifest(delta_since)['outputs']
+    manifest = dict(outputs=dict())
+    if os.path.exists(manifest_path):
+        manifest = _loadBuildManifest(manifest_path)
+
+    # Output files and media are written by I/O threads while the next
+    # output is being assembled.
+    io_pool = ThreadPoolExecutor(
+        max_workers=IO_WORKERS) if pipelined else None
+    pending_io = collections.deque()
+
     for language in languages:
         for deck, deck_build in decks_build.items():
             util.msg("Building deck: %s (Language: %s)" % (deck, language))
+            memprofile.beginPhase(profile, 'output:%s:%s' % (deck, language))
 
             if 'deck' not in deck_build or 'config' not in deck_build:
                 util.err(
@@ -718,17 +1629,22 @@ def build(decks, src_dir, build_dir, lang):
             deck_data['deck_config_uuid'] = config_uuid
 
             deck_data['note_models'] = []
-            for model_id, deck_model in deck_models.items():
-                model = glbals['models'][model_id]
-                deck_data['note_models'].append(
-                    _noteModelInfo(model, localized_model_uuids[model_id],
-                                   deck_model['name']))
+            model_sections = [
+                dict(uuid=localized_model_uuids[model_id],
+                     json=_modelPlanJson(model_plans[model_id],
+                                         localized_model_uuids[model_id],
+                                         deck_model['name']))
+                for model_id, deck_model in deck_models.items()
+            ]
 
             deck_notes = []
             deck_media = []
+            notes_media = []
             seen_media = set()
             seen_guids = set()
-            for note_entry in glbals['notes']:
+            overlay = language_index.get(language, set()) \
+                if language != 'default' else set()
+            for position, note_entry in enumerate(glbals['notes']):
                 note = note_entry['note']
                 model_id = note.get('model')
                 if model_id not in glbals['models']:
@@ -738,27 +1654,20 @@ def build(decks, src_dir, build_dir, lang):
                     util.err("Note '%s' uses model '%s' not enabled for deck '%s'." %
                              (_noteRef(note_entry), model_id, deck))
 
-                model = glbals['models'][model_id]
-                fields_by_name = _fieldValuesForLang(note_entry, language)
-                fields = []
-                for field_name in model['fields']:
-                    if field_name not in fields_by_name:
-                        util.err(
-                            "Missing field '%s' in note '%s' for model '%s'." %
-                            (field_name, _noteRef(note_entry), model_id))
-                    fields.append(fields_by_name[field_name])
-
-                for media_file in _collectDeckMedia(glbals['media'], fields):
+                if position in overlay:
+                    fields, note_media = _localizedNoteFields(
+                        note_entry, model_plans[model_id], glbals['media'],
+                        language)
+                else:
+                    fields, note_media = _defaultNoteFields(
+                        note_entry, model_plans[model_id], glbals['media'])
+                notes_media.append(note_media)
+                for media_file in note_media:
                     if media_file not in seen_media:
                         seen_media.add(media_file)
                         deck_media.append(media_file)
 
-                tags = _normalizeTags(note.get('tags'))
-                if path_tags_config:
-                    tags = _mergeTags(
-                        [tags,
-                         _deriveTagsFromPath(note_entry['source_rel_dir'],
-                                             path_tags_config)])
+                tags = note_entry['tags']
 
                 decoded_guid = util.guidDecode(note_entry['guid'],
                                                localized_model_uuids[model_id])
@@ -783,16 +1692,80 @@ def build(decks, src_dir, build_dir, lang):
 
             localized_deck = deck if language == 'default' else '_'.join(
                 (deck, language))
-            target_build_dir = build_dir or 'build'
+            output_manifest = _outputManifest(deck_data, model_sections,
+                                              deck_notes)
+            manifest['outputs'][localized_deck] = output_manifest
+            if delta_since:
+                if localized_deck in prev_outputs:
+                    delta = _deltaOutput(deck_data, model_sections,
+                                         deck_notes, notes_media,
+                                         output_manifest,
+                                         prev_outputs[localized_deck])
+                    model_sections = delta['model_sections']
+                    deck_media = deck_data['media_files']
+                    util.msg(
+                        "  Delta: %d changed note(s), %d removed, models %s, "
+                        "deck/config %s" %
+                        (delta['changed_count'], delta['removed_count'],
+                         'changed' if delta['models_changed'] else 'unchanged',
+                         'changed' if delta['header_changed'] else 'unchanged'))
+                    if delta['removed_count'] > 0:
+                        util.warn(
+                            "  %d note(s) were removed since the manifest; "
+                            "delete them in Anki manually." %
+                            (delta['removed_count'],))
+                else:
+                    util.warn("  No previous state for '%s' in '%s'; "
+                              "writing full deck." %
+                              (localized_deck, delta_since))
+
+            if output_format == 'apkg':
+                util.prepareDir(target_build_dir)
+                result = apkg.writeApkg(
+                    os.path.join(target_build_dir, localized_deck + '.apkg'),
+                    deck_data,
+                    [json.loads(section['json']) for section in model_sections],
+                    os.path.join(src_dir, 'media'))
+                util.msg("  Wrote %s.apkg (notes: %d, cards: %d)" %
+                         (localized_deck, result['note_count'],
+                          result['card_count']))
+                memprofile.endPhase(profile)
+                continue
+
             deck_dir = os.path.join(target_build_dir, localized_deck)
             util.prepareDir(deck_dir)
-            with open(os.path.join(deck_dir, localized_deck + '.json'), 'w') as f:
-                f.write(util.toJson(deck_data))
+            deck_json = _serializeDeck(
+                deck_data, model_sections, output_manifest['notes'],
+                os.path.join(target_build_dir, DEFAULT_BUILD_CACHE_DIR,
+                             localized_deck + '.fragments.json'))
+            util.submitBounded(io_pool, pending_io, IO_QUEUE_DEPTH,
+                               util.writeRaw,
+                               os.path.join(deck_dir, localized_deck + '.json'),
+                               deck_json)
 
             util.prepareDir(os.path.join(deck_dir, 'media'))
             for media_file in deck_media:
-                shutil.copy(os.path.join(src_dir, 'media', media_file),
-                            os.path.join(deck_dir, 'media', media_file))
+                util.submitBounded(io_pool, pending_io, IO_QUEUE_DEPTH,
+                                   shutil.copy,
+                                   os.path.join(src_dir, 'media', media_file),
+                                   os.path.join(deck_dir, 'media', media_file))
+            memprofile.endPhase(profile)
+
+    util.drainPending(pending_io)
+    if io_pool is not None:
+        io_pool.shutdown()
+
+    if minify_state is not None:
+        minifier.report(minify_state)
+
+    if subtrees is None:
+        _writeBuildManifest(manifest_path, manifest)
+        _recordFingerprints(notes, glbals['models'], src_dir, language_index,
+                            model_plans)
+
+    # Fingerprints minify values of their own, so the cache is closed last.
+    if minify_state is not None:
+        minifier.closeCache(minify_state)
 
 
 def _readDecks(decks, directory):
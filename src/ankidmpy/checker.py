@@ -0,0 +1,232 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+from concurrent.futures import ProcessPoolExecutor
+import os
+import os.path
+import re
+
+MEDIA_REF_RE = re.compile(
+    r'''(?:\bsrc\s*=\s*["']([^"']+)["']|\[sound:([^\]]+)\])''', re.I)
+MEDIA_REF_SKIP_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//)', re.I)
+
+
+def _capture(errors, fn, *args):
+    try:
+        return fn(*args)
+    except RuntimeError as ex:
+        errors.append(str(ex))
+        return None
+
+
+def _mediaRefs(value):
+    refs = []
+    for match in MEDIA_REF_RE.finditer(str(value)):
+        ref = (match.group(1) or match.group(2) or '').strip()
+        if ref and not MEDIA_REF_SKIP_RE.match(ref):
+            refs.append(ref)
+    return refs
+
+
+def _checkNote(note_entry, model_fields, media_files, errors):
+    note = note_entry['note']
+    ref = builder._noteRef(note_entry)
+
+    model_id = note.get('model')
+    fields = note.get('fields')
+    if not isinstance(fields, dict):
+        errors.append("Note '%s' is missing object field 'fields'." % (ref,))
+        fields = {}
+
+    expected = None
+    if model_fields is not None:
+        if model_id not in model_fields:
+            errors.append("Note '%s' references unknown model '%s'." %
+                          (ref, model_id))
+        else:
+            expected = model_fields[model_id]
+            for field_name in expected:
+                if field_name not in fields:
+                    errors.append(
+                        "Missing field '%s' in note '%s' for model '%s'." %
+                        (field_name, ref, model_id))
+
+    values = list(fields.values())
+    langs = _capture(errors, builder._noteLanguages, note_entry)
+    for lang in sorted(langs or []):
+        localized = note['fields_by_lang'][lang]
+        for field_name, value in localized.items():
+            if expected is not None and field_name not in expected:
+                errors.append(
+                    "Unknown field '%s' in fields_by_lang['%s'] on note '%s'."
+                    % (field_name, lang, ref))
+            values.append(value)
+
+    if media_files is not None:
+        for value in values:
+            if value is None:
+                continue
+            for media_ref in _mediaRefs(value):
+                if media_ref not in media_files:
+                    errors.append("Missing media file '%s' referenced by note '%s'."
+                                  % (media_ref, ref))
+
+
+def _loadDataFile(data_file, parse_cache_dir, unchanged):
+    if parse_cache_dir is None:
+        return util.getNotes(data_file['path'], True)
+    if unchanged:
+        notes = builder._cachedNotes(data_file, parse_cache_dir)
+        if notes is not None:
+            return dict(notes=notes)
+    return builder._readDataFile(data_file, parse_cache_dir)
+
+
+def _checkDataFile(data_file,
+                   model_fields,
+                   media_files,
+                   parse_cache_dir=None,
+                   unchanged=False):
+    errors = []
+    keys = []
+    models_used = dict()
+
+    data = _capture(errors, _loadDataFile, data_file, parse_cache_dir,
+                    unchanged)
+    if errors:
+        return dict(errors=errors, keys=keys, models_used=models_used)
+    if not isinstance(data, dict):
+        errors.append("File '%s' must contain a top-level object." %
+                      (data_file['path'],))
+        return dict(errors=errors, keys=keys, models_used=models_used)
+
+    file_notes = data.get('notes')
+    if not isinstance(file_notes, list):
+        errors.append("File '%s' must contain a 'notes' list." %
+                      (data_file['path'],))
+        return dict(errors=errors, keys=keys, models_used=models_used)
+
+    for i, note in enumerate(file_notes):
+        if not isinstance(note, dict):
+            errors.append("Invalid note at index %d in '%s'." %
+                          (i, data_file['path']))
+            continue
+        note_entry = dict(note=note,
+                          note_index=i,
+                          source_file=data_file['path'],
+                          source_rel_file=data_file['rel_path'],
+                          source_rel_dir=data_file['rel_dir'])
+        key = _capture(errors, builder._noteGuidKey, note_entry)
+        if key is not None:
+            keys.append((key, builder._noteRef(note_entry)))
+        model_id = note.get('model')
+        if isinstance(model_id, str) and model_id not in models_used:
+            models_used[model_id] = builder._noteRef(note_entry)
+        _checkNote(note_entry, model_fields, media_files, errors)
+
+    return dict(errors=errors, keys=keys, models_used=models_used)
+
+
+def _checkDecks(src_dir, models, errors):
+    decks = dict()
+    decks_dir = os.path.join(src_dir, 'decks')
+    for deck in sorted(util.getFilesList(decks_dir, 'dir')):
+        deck_build = _capture(errors, builder._readDeck,
+                              os.path.join(decks_dir, deck))
+        if deck_build is None:
+            continue
+        for section in ('deck', 'config'):
+            if not isinstance(deck_build.get(section), dict) or \
+                    not deck_build[section].get('uuid'):
+                errors.append("Deck '%s' build file is missing '%s.uuid'." %
+                              (deck, section))
+        if models is None:
+            continue
+        deck_models = _capture(errors, builder._normalizeDeckModels,
+                               deck_build, models)
+        if deck_models is not None:
+            decks[deck] = deck_models
+    if not decks and models is not None and not errors:
+        errors.append("No decks found in '%s'." % (decks_dir,))
+    return decks
+
+
+def checkIt(base, jobs=None, changed_since=None):
+    errors = []
+
+    config = _capture(errors, builder.loadAnkiDmConfig, base)
+    models = _capture(errors, builder._loadModels, base)
+    decks = _checkDecks(base, models, errors)
+
+    model_fields = None
+    if models is not None:
+        model_fields = dict(
+            (model_id, model['fields']) for model_id, model in models.items())
+    media_dir = os.path.join(base, 'media')
+    media_files = set(util.getFilesList(media_dir)) if os.path.isdir(
+        media_dir) else None
+
+    data_files = []
+    if config is not None:
+        data_files = _capture(errors, builder._findDataFiles, config) or []
+
+    # With --changed-since every check still runs, but files git reports as
+    # unchanged are read from the parse cache instead of being parsed.
+    parse_cache_dir = None
+    unchanged = [False] * len(data_files)
+    if changed_since and config is not None:
+        parse_cache_dir = builder._parseCacheDir(config)
+        changed = builder._gitChanges(config, changed_since)
+        unchanged = [
+            builder._isUnchanged(data_file, changed) for data_file in data_files
+        ]
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(data_files) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(
+                executor.map(_checkDataFile,
+                             data_files, [model_fields] * len(data_files),
+                             [media_files] * len(data_files),
+                             [parse_cache_dir] * len(data_files),
+                             unchanged,
+                             chunksize=max(1, len(data_files) // (jobs * 4))))
+    else:
+        results = [
+            _checkDataFile(data_file, model_fields, media_files,
+                           parse_cache_dir, is_unchanged)
+            for data_file, is_unchanged in zip(data_files, unchanged)
+        ]
+    if parse_cache_dir is not None:
+        builder._recordGitState(config)
+
+    known_keys = dict()
+    models_used = dict()
+    n_notes = 0
+    for result in results:
+        errors.extend(result['errors'])
+        for key, ref in result['keys']:
+            n_notes += 1
+            if key in known_keys:
+                errors.append("Duplicate note identity key found: %s (%s, %s)"
+                              % (key, known_keys[key], ref))
+            else:
+                known_keys[key] = ref
+        for model_id, ref in result['models_used'].items():
+            models_used.setdefault(model_id, ref)
+
+    for deck, deck_models in sorted(decks.items()):
+        for model_id, ref in sorted(models_used.items()):
+            if models is not None and model_id in models and \
+                    model_id not in deck_models:
+                errors.append(
+                    "Note '%s' uses model '%s' not enabled for deck '%s'." %
+                    (ref, model_id, deck))
+
+    for error in errors:
+        util.warn(error)
+    if errors:
+        util.err("Check failed with %d error(s) in %d data file(s)." %
+                 (len(errors), len(data_files)))
+
+    util.msg("Check passed: %d note(s) in %d data file(s)." %
+             (n_notes, len(data_files)))
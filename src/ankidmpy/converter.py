@@ -0,0 +1,62 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+import os
+import os.path
+
+
+def _renameGuidKeys(guid_map, src_rel, dst_rel):
+    renamed = 0
+    for prefix in ('id:', 'idx:'):
+        old_prefix = '%s%s#' % (prefix, src_rel)
+        for key in [key for key in guid_map if key.startswith(old_prefix)]:
+            guid_map['%s%s#%s' % (prefix, dst_rel, key[len(old_prefix):])] = \
+                guid_map.pop(key)
+            renamed += 1
+    return renamed
+
+
+def convertIt(base, src, dst):
+    if util.isJsonl(src) == util.isJsonl(dst):
+        util.err("Convert needs one .yaml and one .jsonl path: '%s' -> '%s'." %
+                 (src, dst))
+    if os.path.exists(dst):
+        util.err("Destination already exists: %s" % (dst,))
+
+    data = util.getNotes(src, required=True)
+    if not isinstance(data, dict) or not isinstance(data.get('notes'), list):
+        util.err("File '%s' must contain a 'notes' list." % (src,))
+    for i, note in enumerate(data['notes']):
+        if not isinstance(note, dict):
+            util.err("Invalid note at index %d in '%s'." % (i, src))
+    dropped = sorted(key for key in data if key != 'notes')
+    if dropped and util.isJsonl(dst):
+        util.err("File '%s' has top-level keys other than 'notes' (%s) that "
+                 "JSON Lines cannot hold." % (src, ', '.join(dropped)))
+
+    try:
+        contents = util.dumpNotes(dst, dict(notes=data['notes']))
+    except TypeError as ex:
+        util.err("Cannot convert '%s': %s" % (src, ex))
+
+    # Notes keep their guids: the guid-map keys of the source file move to
+    # the destination, whose note ids and indices are unchanged.
+    config = builder.loadAnkiDmConfig(base)
+    src_rel = builder._crawlRelPath(config, src)
+    dst_rel = builder._crawlRelPath(config, dst)
+    guid_map, guid_map_path = builder._loadGuidMap(base)
+    renamed = 0
+    if src_rel is not None and dst_rel is not None:
+        renamed = _renameGuidKeys(guid_map, src_rel, dst_rel)
+
+    util.prepareDir(os.path.dirname(os.path.abspath(dst)))
+    util.writeRaw(dst, contents)
+    if renamed:
+        builder._writeGuidMap(guid_map_path, guid_map)
+    os.remove(src)
+
+    util.msg("Converted '%s' to '%s' (%d notes, %d guid-map keys moved)." %
+             (src, dst, len(data['notes']), renamed))
+    if dst_rel is not None and not builder._matchesAny(
+            dst_rel, config['crawl_include']):
+        util.warn("'%s' is not matched by crawl.include in %s." %
+                  (dst_rel, builder.DEFAULT_ANKIDM_CONFIG))
@@ -0,0 +1,124 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import random
+import zlib
+
+SHINGLE_SIZE = 4
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# XOR with a random mask permutes the 32-bit shingle hashes; it is not
+# strictly min-wise independent but far cheaper than modular arithmetic.
+_rng = random.Random(0x616e6b69)
+MASKS = [_rng.getrandbits(32) for _ in range(NUM_PERM)]
+
+
+def _minHash(text):
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {zlib.crc32(text.encode('utf-8'))}
+    else:
+        shingles = set(
+            zlib.crc32(text[i:i + SHINGLE_SIZE].encode('utf-8'))
+            for i in range(len(text) - SHINGLE_SIZE + 1))
+    return tuple(min([shingle ^ mask for shingle in shingles]) for mask in MASKS)
+
+
+def _minHashes(texts):
+    return [_minHash(text) for text in texts]
+
+
+def _similarity(left, right):
+    return sum(1 for a, b in zip(left, right) if a == b) / float(NUM_PERM)
+
+
+def _find(parents, item):
+    root = item
+    while parents[root] != root:
+        root = parents[root]
+    while parents[item] != root:
+        parents[item], item = root, parents[item]
+    return root
+
+
+def _union(parents, left, right):
+    left, right = _find(parents, left), _find(parents, right)
+    if left != right:
+        parents[max(left, right)] = min(left, right)
+
+
+def _signatures(texts, jobs):
+    if jobs <= 1 or len(texts) < 1000:
+        return _minHashes(texts)
+    chunk = max(1, len(texts) // (jobs * 4))
+    chunks = [texts[i:i + chunk] for i in range(0, len(texts), chunk)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return [sig for sigs in executor.map(_minHashes, chunks) for sig in sigs]
+
+
+def findDupes(base, threshold=0.8, jobs=None):
+    if not 0 < threshold <= 1:
+        util.err("Invalid threshold: %s. Expected a value in (0, 1]." %
+                 (threshold,))
+
+    config = builder.loadAnkiDmConfig(base)
+    notes = builder.loadCrawledNotes(config)
+
+    # Exact duplicates share the hash of their normalized text; only one
+    # representative per hash takes part in near-duplicate detection.
+    exact = dict()
+    for note_entry in notes:
+        fields = note_entry['note'].get('fields')
+        if not isinstance(fields, dict):
+            continue
+        text = util.normalizeText(fields.values())
+        if not text:
+            continue
+        digest = hashlib.sha1(text.encode('utf-8')).digest()
+        group = exact.setdefault(digest, dict(text=text, notes=[]))
+        group['notes'].append(note_entry)
+
+    groups = list(exact.values())
+    signatures = _signatures([group['text'] for group in groups],
+                             jobs or os.cpu_count() or 1)
+
+    # LSH banding: groups sharing any band bucket are candidates.  Each
+    # candidate is compared with the first member of its bucket only, which
+    # keeps the work linear even for large buckets.
+    parents = list(range(len(groups)))
+    for band in range(BANDS):
+        buckets = dict()
+        start = band * ROWS
+        for i, signature in enumerate(signatures):
+            key = signature[start:start + ROWS]
+            first = buckets.setdefault(key, i)
+            if first != i and _similarity(signature,
+                                          signatures[first]) >= threshold:
+                _union(parents, first, i)
+
+    clusters = dict()
+    for i in range(len(groups)):
+        clusters.setdefault(_find(parents, i), []).append(i)
+
+    n_exact = 0
+    n_near = 0
+    for members in sorted(clusters.values(), key=lambda m: m[0]):
+        refs = [
+            builder._noteIdRef(note_entry) for i in members
+            for note_entry in groups[i]['notes']
+        ]
+        if len(refs) < 2:
+            continue
+        if len(members) == 1:
+            n_exact += 1
+            util.msg("Exact duplicates (%d notes):" % (len(refs),))
+        else:
+            n_near += 1
+            util.msg("Near duplicates (%d notes):" % (len(refs),))
+        for ref in refs:
+            util.msg("  %s" % (ref,))
+
+    util.msg("Found %d exact and %d near-duplicate cluster(s) among %d notes."
+             % (n_exact, n_near, len(notes)))
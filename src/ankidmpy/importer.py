@@ -114,43 +114,44 @@ def importIt(path, directory, deck=None):
                                 include=['**/data.yaml'],
                                 exclude=['build/**']))))
 
-    notes_data = []
     guid_map = dict()
     rel_data_file = 'data.yaml'
-    for i, note in enumerate(deck_data['notes']):
-        model_uuid = note.get('note_model_uuid')
-        if model_uuid not in model_uuid_to_id:
-            util.err("Cannot find note model for note: %s" %
-                     (note.get('guid') or '<missing-guid>',))
-        model_id = model_uuid_to_id[model_uuid]
-        model_data = model_by_id[model_id]
-        field_names = model_data['fields']
-        if len(note['fields']) != len(field_names):
-            util.err(
-                "Field count mismatch for note '%s' in model '%s'. Expected %d fields, got %d."
-                % (note.get('guid') or '<missing-guid>', model_data['name'],
-                   len(field_names), len(note['fields'])))
-
-        fields_data = dict()
-        for field_idx, field_name in enumerate(field_names):
-            fields_data[field_name] = note['fields'][field_idx]
-
-        tags = note.get('tags') or []
-        if not isinstance(tags, list):
-            tags = [tag for tag in str(tags).split(' ') if tag]
-
-        guid_map['idx:%s#%d' %
-                 (rel_data_file, i)] = util.guidEncode(
-                     note['guid'], build_info['models'][model_id]['uuid'])
-        notes_data.append(
-            dict(model=model_id,
-                 fields=fields_data,
-                 tags=tags))
 
+    def notesData():
+        for i, note in enumerate(deck_data['notes']):
+            model_uuid = note.get('note_model_uuid')
+            if model_uuid not in model_uuid_to_id:
+                util.err("Cannot find note model for note: %s" %
+                         (note.get('guid') or '<missing-guid>',))
+            model_id = model_uuid_to_id[model_uuid]
+            model_data = model_by_id[model_id]
+            field_names = model_data['fields']
+            if len(note['fields']) != len(field_names):
+                util.err(
+                    "Field count mismatch for note '%s' in model '%s'. Expected %d fields, got %d."
+                    % (note.get('guid') or '<missing-guid>', model_data['name'],
+                       len(field_names), len(note['fields'])))
+
+            fields_data = dict()
+            for field_idx, field_name in enumerate(field_names):
+                fields_data[field_name] = note['fields'][field_idx]
+
+            tags = note.get('tags') or []
+            if not isinstance(tags, list):
+                tags = [tag for tag in str(tags).split(' ') if tag]
+
+            guid_map['idx:%s#%d' %
+                     (rel_data_file, i)] = util.guidEncode(
+                         note['guid'], build_info['models'][model_id]['uuid'])
+            yield dict(model=model_id,
+                       fields=fields_data,
+                       tags=tags)
+
+    # Notes are written as they are converted; the guid map fills up on the way.
     with open(os.path.join(directory, 'data.yaml'), 'w') as f:
-        f.write(util.toYaml(dict(notes=notes_data)))
+        util.writeYaml(f, dict(notes=notesData()), 'notes')
     with open(os.path.join(directory, 'guid-map.yaml'), 'w') as f:
-        f.write(util.toYaml(dict(guids=guid_map)))
+        util.writeYaml(f, dict(guids=guid_map.items()), 'guids', pairs=True)
 
     media_files = deck_data['media_files']
     util.prepareDir(os.path.join(directory, 'media'))
@@ -3,10 +3,15 @@ import ankidmpy.util as util
 import os.path
 
 
-def indexIt(full, base):
+def indexIt(full, base, changed_since=None, paths=None):
     config = builder.loadAnkiDmConfig(base)
-    notes = builder.loadCrawledNotes(config)
-    result = builder.reindexGuidMap(notes, base, full=full)
+    if paths:
+        if changed_since:
+            util.err("--changed-since cannot be combined with note file paths.")
+        result = builder.reindexGuidMapFiles(config, paths, base, full=full)
+    else:
+        notes = builder.loadCrawledNotes(config, changed_since=changed_since)
+        result = builder.reindexGuidMap(notes, base, full=full)
 
     if result['changed']:
         util.msg("Successfully reindexed '%s' (added: %d, removed: %d, reassigned: %d)"
@@ -0,0 +1,127 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+import glob
+import os
+import os.path
+import zlib
+
+SHARD_NAME = 'part-%04d' + util.JSONL_EXT
+TAGS_COLUMN = 'tags'
+
+
+def _keyRelPath(key):
+    for prefix in ('id:', 'idx:'):
+        if key.startswith(prefix):
+            return key[len(prefix):key.rfind('#')]
+    return None
+
+
+def _checkColumns(fields, model, key_column):
+    unknown = sorted(
+        field for field in fields
+        if field not in model['fields'] and field not in (key_column,
+                                                          TAGS_COLUMN))
+    if unknown:
+        util.err("CSV columns are not fields of model '%s': %s" %
+                 (model['id'], ', '.join(unknown)))
+    if key_column not in fields:
+        util.err("CSV has no key column '%s'." % (key_column,))
+
+
+def ingestCsv(base, csv_path, out_dir, model_id, key_column, shards=16):
+    if shards < 1:
+        util.err("Invalid shard count: %d" % (shards,))
+    config = builder.loadAnkiDmConfig(base)
+    models = builder._loadModels(base)
+    if model_id not in models:
+        util.err("Unknown model '%s'." % (model_id,))
+    model = models[model_id]
+
+    out_rel = builder._crawlRelPath(config, out_dir)
+    if out_rel is None:
+        util.err("Output directory '%s' is not under crawl.root." % (out_dir,))
+    out_rel = '' if out_rel == '.' else out_rel + '/'
+    shard_rels = [out_rel + SHARD_NAME % (i,) for i in range(shards)]
+
+    # Every part-*.jsonl under the output directory is owned by the ingest,
+    # whatever shard count wrote it.  Previous guids are reused by key value,
+    # so notes keep their guid when a new shard count moves them.
+    owned_rels = set(shard_rels)
+    for path in glob.glob(os.path.join(out_dir, 'part-*' + util.JSONL_EXT)):
+        owned_rels.add(out_rel + os.path.basename(path))
+    guid_map, guid_map_path = builder._loadGuidMap(base)
+    previous = dict()
+    for key in list(guid_map):
+        if _keyRelPath(key) in owned_rels:
+            guid = guid_map.pop(key)
+            if key.startswith('id:'):
+                previous[key[key.rfind('#') + 1:]] = guid
+    used_guids = set(guid_map.values())
+
+    util.prepareDir(out_dir)
+    shard_paths = [
+        os.path.join(config['crawl_root'], shard_rel)
+        for shard_rel in shard_rels
+    ]
+    shard_files = [open(path + '.tmp', 'w') for path in shard_paths]
+    seen_keys = set()
+    try:
+        checked = False
+        for row_no, fields, fields_by_lang in util.iterCsv(csv_path):
+            if not checked:
+                _checkColumns(fields, model, key_column)
+                checked = True
+            key_value = fields.pop(key_column).strip()
+            if not key_value:
+                util.err("Empty key column '%s' at line %d of '%s'." %
+                         (key_column, row_no, csv_path))
+            tags = fields.pop(TAGS_COLUMN, '').split()
+
+            shard = zlib.crc32(key_value.encode('utf-8')) % shards
+            key = 'id:%s#%s' % (shard_rels[shard], key_value)
+            if key in seen_keys:
+                util.err("Duplicate key '%s' at line %d of '%s'." %
+                         (key_value, row_no, csv_path))
+            seen_keys.add(key)
+
+            note = dict(id=key_value,
+                        model=model_id,
+                        fields=dict((field, fields.get(field, ''))
+                                    for field in model['fields']))
+            if fields_by_lang:
+                note['fields_by_lang'] = fields_by_lang
+            if tags:
+                note['tags'] = tags
+            shard_files[shard].write(util.toJsonl([note]))
+
+            guid = previous.get(key_value)
+            if guid is None or guid in used_guids:
+                guid = builder._deterministicUniqueGuidForKey(key, used_guids)
+            used_guids.add(guid)
+            guid_map[key] = guid
+    except BaseException:
+        for f in shard_files:
+            f.close()
+            os.remove(f.name)
+        raise
+
+    for f, path in zip(shard_files, shard_paths):
+        f.close()
+        os.replace(f.name, path)
+    stale_rels = sorted(owned_rels.difference(shard_rels))
+    for stale_rel in stale_rels:
+        os.remove(os.path.join(config['crawl_root'], stale_rel))
+    builder._writeGuidMap(guid_map_path, guid_map)
+
+    n_kept = sum(1 for key in seen_keys if key[key.rfind('#') + 1:] in previous)
+    util.msg("Ingested %d notes into %d shard(s) under '%s' "
+             "(new: %d, kept guids: %d, removed: %d)." %
+             (len(seen_keys), shards, out_dir, len(seen_keys) - n_kept,
+              n_kept, len(previous) - n_kept))
+    if stale_rels:
+        util.msg("Removed %d shard file(s) of a previous ingest with more "
+                 "shards." % (len(stale_rels),))
+
+    if not builder._matchesAny(shard_rels[0], config['crawl_include']):
+        util.warn("'%s' is not matched by crawl.include in %s." %
+                  (shard_rels[0], builder.DEFAULT_ANKIDM_CONFIG))
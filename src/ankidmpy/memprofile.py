@@ -0,0 +1,77 @@
+import ankidmpy.util as util
+import fnmatch
+import tracemalloc
+
+MB = 1024.0 * 1024.0
+TOP_SITES = 5
+
+
+def parseBudgets(specs):
+    budgets = []
+    for spec in specs or []:
+        phase, sep, value = spec.rpartition('=')
+        try:
+            limit = float(value)
+        except ValueError:
+            limit = None
+        if not sep or not phase.strip() or limit is None or limit <= 0:
+            util.err("Invalid memory budget '%s': expected PHASE=MB." %
+                     (spec,))
+        budgets.append((phase.strip(), limit))
+    return budgets
+
+
+def _takeSnapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def createProfile(enabled, budgets=None):
+    if not enabled and not budgets:
+        return None
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return dict(budgets=budgets or [], phase=None, results=[])
+
+
+def beginPhase(profile, name):
+    if profile is None:
+        return
+    if profile['phase'] is not None:
+        endPhase(profile)
+    snapshot = _takeSnapshot()
+    # Before Python 3.9 the peak cannot be reset, so it covers all phases
+    # traced so far.
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    profile['phase'] = dict(name=name, start=current, snapshot=snapshot)
+
+
+def endPhase(profile):
+    if profile is None or profile['phase'] is None:
+        return
+    phase = profile['phase']
+    profile['phase'] = None
+
+    current, peak = tracemalloc.get_traced_memory()
+    stats = _takeSnapshot().compare_to(phase['snapshot'], 'lineno')
+    result = dict(name=phase['name'],
+                  peak=peak,
+                  retained=current - phase['start'],
+                  sites=[stat for stat in stats if stat.size_diff > 0][:TOP_SITES])
+    profile['results'].append(result)
+
+    util.msg("Memory [%s]: peak %.1f MB, retained %+.1f MB" %
+             (result['name'], result['peak'] / MB, result['retained'] / MB))
+    for stat in result['sites']:
+        frame = stat.traceback[0]
+        util.msg("    %+.1f MB  %s:%d" %
+                 (stat.size_diff / MB, frame.filename, frame.lineno))
+
+    for pattern, limit in profile['budgets']:
+        if fnmatch.fnmatchcase(result['name'], pattern) and \
+                result['peak'] / MB > limit:
+            util.err("Memory budget exceeded in phase '%s': peak %.1f MB > "
+                     "%g MB (budget '%s')" %
+                     (result['name'], result['peak'] / MB, limit, pattern))
@@ -0,0 +1,208 @@
+import ankidmpy.util as util
+import hashlib
+import json
+import os
+import re
+
+DEFAULT_MINIFY_CACHE = 'minify.json'
+MINIFY_VERSION = 2
+
+CSS_TOKEN_RE = re.compile(
+    r'''/\*.*?(?:\*/|$)|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|\burl\([^)]*\)''',
+    re.S | re.I)
+CSS_SPACE_RE = re.compile(r'[ \t\n\r\f]+')
+CSS_PUNCT_RE = re.compile(r' ?([{};,>]) ?')
+CSS_COLON_RE = re.compile(r': ')
+
+HTML_SPACE_RE = re.compile(r'[ \t\n\r\f]+')
+# Everything Anki or the browser reads whitespace-sensitively is kept as is:
+# template and cloze tags, MathJax, Anki LaTeX, sound tags, tags themselves
+# and the content of elements that do not collapse whitespace.
+HTML_TOKEN_RE = re.compile(
+    r'\{\{|\\\(|\\\[|\[(\$\$?|latex)\]|\[sound:[^\]]*\]|<!--|'
+    r'<(pre|textarea|script|style|code)\b|</?([A-Za-z][A-Za-z0-9]*)[^>]*>',
+    re.I)
+BLOCK_TAGS = frozenset(
+    ('address', 'article', 'aside', 'blockquote', 'body', 'br', 'dd', 'details',
+     'div', 'dl', 'dt', 'fieldset', 'figcaption', 'figure', 'footer', 'form',
+     'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'head', 'header', 'hr', 'html', 'li',
+     'link', 'main', 'meta', 'nav', 'ol', 'p', 'section', 'summary', 'table',
+     'tbody', 'td', 'tfoot', 'th', 'thead', 'title', 'tr', 'ul'))
+RAW_ELEMENT_RE = re.compile(r'<(pre|textarea|script|code)\b', re.I)
+CSS_PRE_RE = re.compile(r'white-space\s*:\s*(pre|break-spaces)', re.I)
+
+
+def _splitCss(css):
+    # (verbatim, text) pairs; comments, strings and url() are verbatim.
+    pos = 0
+    for m in CSS_TOKEN_RE.finditer(css):
+        yield False, css[pos:m.start()]
+        yield True, m.group(0)
+        pos = m.end()
+    yield False, css[pos:]
+
+
+def _minifyCssText(text):
+    text = CSS_SPACE_RE.sub(' ', text)
+    text = CSS_PUNCT_RE.sub(r'\1', text)
+    text = CSS_COLON_RE.sub(':', text)
+    return text.replace(';}', '}')
+
+
+def minifyCss(css):
+    # Comments go first so the whitespace around them collapses with the rest.
+    css = ''.join(' ' if verbatim and text.startswith('/*') else text
+                  for verbatim, text in _splitCss(css))
+    return ''.join(text if verbatim else _minifyCssText(text)
+                   for verbatim, text in _splitCss(css)).strip()
+
+
+def _braceEnd(text, pos):
+    depth = 1
+    while depth:
+        opening = text.find('{{', pos)
+        closing = text.find('}}', pos)
+        if closing < 0:
+            return len(text)
+        if 0 <= opening < closing:
+            depth += 1
+            pos = opening + 2
+        else:
+            depth -= 1
+            pos = closing + 2
+    return pos
+
+
+def _tokenEnd(text, m):
+    token = m.group(0)
+    if token == '{{':
+        return _braceEnd(text, m.end())
+    if token in ('\\(', '\\['):
+        end = text.find('\\)' if token == '\\(' else '\\]', m.end())
+        return len(text) if end < 0 else end + 2
+    if m.group(1):
+        end = text.find('[/%s]' % (m.group(1),), m.end())
+        return len(text) if end < 0 else end + len(m.group(1)) + 3
+    if token == '<!--':
+        end = text.find('-->', m.end())
+        return len(text) if end < 0 else end + 3
+    if m.group(2):
+        closing = re.compile(r'</%s\s*>' % (m.group(2),), re.I).search(
+            text, m.end())
+        return len(text) if closing is None else closing.end()
+    return m.end()
+
+
+def _htmlTokens(html):
+    # (kind, text) pairs: 'text', 'keep', 'block' (a block-level tag) and
+    # 'comment'.
+    tokens = []
+    pos = 0
+    while True:
+        m = HTML_TOKEN_RE.search(html, pos)
+        if m is None:
+            break
+        end = _tokenEnd(html, m)
+        if m.start() > pos:
+            tokens.append(('text', html[pos:m.start()]))
+        if m.group(0) == '<!--':
+            kind = 'comment'
+        elif m.group(3) and m.group(3).lower() in BLOCK_TAGS:
+            kind = 'block'
+        else:
+            kind = 'keep'
+        tokens.append((kind, html[m.start():end]))
+        pos = end
+    if pos < len(html):
+        tokens.append(('text', html[pos:]))
+    return tokens
+
+
+def minifyHtml(html):
+    tokens = []
+    for kind, text in _htmlTokens(html):
+        if kind == 'comment':
+            continue
+        if kind == 'text' and tokens and tokens[-1][0] == 'text':
+            tokens[-1] = ('text', tokens[-1][1] + text)
+        else:
+            tokens.append((kind, text))
+
+    parts = []
+    for i, (kind, text) in enumerate(tokens):
+        if kind != 'text':
+            parts.append(text)
+            continue
+        text = HTML_SPACE_RE.sub(' ', text)
+        # Whitespace next to a block-level tag never renders.  Whitespace at
+        # either end is kept: a field may be placed inline in a template.
+        if i > 0 and tokens[i - 1][0] == 'block':
+            text = text.lstrip(' ')
+        if i < len(tokens) - 1 and tokens[i + 1][0] == 'block':
+            text = text.rstrip(' ')
+        parts.append(text)
+    return ''.join(parts)
+
+
+def keepsFieldWhitespace(model):
+    # Fields of a model that styles whitespace as significant or places
+    # fields in raw elements are left alone.
+    if CSS_PRE_RE.search(model.get('css') or ''):
+        return True
+    for template in model['templates']:
+        for key in ('qfmt', 'afmt', 'bqfmt', 'bafmt'):
+            if RAW_ELEMENT_RE.search(template.get(key) or ''):
+                return True
+    return False
+
+
+def openCache(path):
+    cache = dict()
+    if os.path.exists(path):
+        try:
+            cache = util.getJson(path)
+        except ValueError:
+            util.warn("Ignoring unreadable minify cache: %s" % (path,))
+    if not isinstance(cache, dict) or cache.get('version') != MINIFY_VERSION:
+        cache = dict()
+    entries = cache.get('entries')
+    return dict(path=path,
+                entries=entries if isinstance(entries, dict) else {},
+                used=dict(),
+                count=0,
+                bytes_in=0,
+                bytes_out=0)
+
+
+def minify(state, kind, text):
+    key = hashlib.sha1(('%s\0%s' % (kind, text)).encode('utf-8')).hexdigest()
+    if key in state['used']:
+        result = state['used'][key]
+    elif key in state['entries']:
+        result = state['entries'][key]
+    else:
+        result = minifyCss(text) if kind == 'css' else minifyHtml(text)
+        if result == text:
+            result = None
+    state['used'][key] = result
+    if result is None:
+        result = text
+    state['count'] += 1
+    state['bytes_in'] += len(text.encode('utf-8'))
+    state['bytes_out'] += len(result.encode('utf-8'))
+    return result
+
+
+def report(state):
+    saved = state['bytes_in'] - state['bytes_out']
+    util.msg("Minified %d value(s): %d -> %d bytes (saved %d bytes, %.1f%%)" %
+             (state['count'], state['bytes_in'], state['bytes_out'], saved,
+              100.0 * saved / state['bytes_in'] if state['bytes_in'] else 0.0))
+
+
+def closeCache(state):
+    util.prepareDir(os.path.dirname(state['path']))
+    with open(state['path'], 'w') as f:
+        f.write(
+            json.dumps(dict(version=MINIFY_VERSION, entries=state['used']),
+                       ensure_ascii=False))
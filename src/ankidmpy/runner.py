@@ -1,8 +1,15 @@
+import ankidmpy.batcher as batcher
 import ankidmpy.builder as builder
+import ankidmpy.checker as checker
+import ankidmpy.converter as converter
 import ankidmpy.copier as copier
+import ankidmpy.dupes as dupes
 import ankidmpy.indexer as indexer
+import ankidmpy.ingester as ingester
 import ankidmpy.util as util
 import ankidmpy.importer as importer
+import ankidmpy.memprofile as memprofile
+import ankidmpy.searcher as searcher
 import ankidmpy.syncer as syncer
 import os.path
 import argparse
@@ -37,11 +44,40 @@ def importDeck(args):
 
 
 def buildDeck(args):
-    builder.build(args.deck, args.base, args.build, args.lang)
+    builder.build(args.deck, args.base, args.build, args.lang,
+                  args.delta_since, args.only, not args.no_pipeline,
+                  args.profile, args.format, args.incremental_parse,
+                  args.changed_since, args.minify)
+
+
+def buildAllDecks(args):
+    batcher.buildAll(args.paths, args.build, args.lang, args.format, args.jobs,
+                     args.incremental_parse)
+
+
+def checkDeck(args):
+    checker.checkIt(args.base, args.jobs, args.changed_since)
+
+
+def findDupes(args):
+    dupes.findDupes(args.base, args.threshold, args.jobs)
+
+
+def queryNotes(args):
+    searcher.queryIt(args.base, args.words, args.tags, args.limit)
 
 
 def indexDeck(args):
-    indexer.indexIt(args.full, args.base)
+    indexer.indexIt(args.full, args.base, args.changed_since, args.paths)
+
+
+def convertNotes(args):
+    converter.convertIt(args.base, args.src, args.dst)
+
+
+def ingestCsv(args):
+    ingester.ingestCsv(args.base, args.csv, args.out, args.model, args.key,
+                       args.shards)
 
 
 def copyDeck(args):
@@ -49,7 +85,22 @@ def copyDeck(args):
 
 
 def syncDeck(args):
-    syncer.syncIt(args.path, args.base, args.deck, args.new_notes_file, args.dry_run)
+    syncer.syncIt(args.path, args.base, args.deck, args.new_notes_file,
+                  args.dry_run, args.profile, args.from_collection,
+                  args.collection_lang)
+
+
+def addChangedSinceArgument(parser):
+    parser.add_argument(
+        '--changed-since',
+        dest='changed_since',
+        metavar='REV',
+        default=None,
+        help='''Ask git which note files changed since REV (committed,
+                          staged, unstaged or untracked) and load all others
+                          from the parse cache under .cache/notes. Falls back
+                          to a full parse without git or when the cache is
+                          older than REV.''')
 
 
 def parse_arguments():
@@ -107,8 +158,85 @@ def parse_arguments():
                               dest='build',
                               help='''Path to the build directory.
                           [Default: build]''')
+    parser_build.add_argument(
+        '--delta-since',
+        dest='delta_since',
+        default=None,
+        help='''Path to the manifest.json of a previous build. Only notes
+                          whose guid, fields or tags changed since then are written.''')
+    parser_build.add_argument(
+        '--only',
+        dest='only',
+        nargs='+',
+        default=None,
+        help='''Glob(s) relative to crawl.root selecting the subtrees to build.
+                          A preview deck is written to <build>/preview and the
+                          guid map keeps entries of all other notes.''')
+    parser_build.add_argument(
+        '--format',
+        dest='format',
+        choices=builder.OUTPUT_FORMATS,
+        default='crowdanki',
+        help='''Output format: a CrowdAnki deck directory or an Anki
+                          package (<deck>.apkg). [Default: crowdanki]''')
+    parser_build.add_argument(
+        '--no-pipeline',
+        dest='no_pipeline',
+        action='store_true',
+        help='''Read, parse and write strictly in sequence instead of
+                          overlapping file I/O with parsing and serialization.''')
+    parser_build.add_argument(
+        '--incremental-parse',
+        dest='incremental_parse',
+        action='store_true',
+        help='''Parse each note of a data file separately and cache the
+                          results under .cache/notes, so edits re-parse only
+                          the notes they touch.''')
+    parser_build.add_argument(
+        '--minify',
+        dest='minify',
+        action='store_true',
+        help='''Minify model CSS and templates and collapse insignificant
+                          whitespace in field HTML, keeping cloze, MathJax and
+                          LaTeX untouched. Results are cached under
+                          <build>/.cache.''')
+    addChangedSinceArgument(parser_build)
     parser_build.set_defaults(command=buildDeck)
 
+    parser_build_all = subparsers.add_parser(
+        'build-all',
+        help="Build many deck sets concurrently in one invocation.")
+    parser_build_all.add_argument(
+        'paths',
+        nargs='+',
+        help='''Directories or globs searched for deck sets (directories
+                          containing ankidm.yaml). --base is ignored.''')
+    parser_build_all.add_argument(
+        '--build',
+        dest='build',
+        help='''Parent build directory; each deck set is built into
+                          <build>/<deck set name>. [Default: <deck set>/build]''')
+    parser_build_all.add_argument('--lang',
+                                  dest='lang',
+                                  help='Build decks for this language code only.')
+    parser_build_all.add_argument('--format',
+                                  dest='format',
+                                  choices=builder.OUTPUT_FORMATS,
+                                  default='crowdanki',
+                                  help='Output format. [Default: crowdanki]')
+    parser_build_all.add_argument('--jobs',
+                                  dest='jobs',
+                                  type=int,
+                                  default=None,
+                                  help='''Number of deck sets built in parallel.
+                          [Default: number of CPUs]''')
+    parser_build_all.add_argument(
+        '--incremental-parse',
+        dest='incremental_parse',
+        action='store_true',
+        help='Use the per-note parse cache of each deck set.')
+    parser_build_all.set_defaults(command=buildAllDecks)
+
     parser_copy = subparsers.add_parser(
         'copy', help='Make reindexed copy of Anki-dm deck.')
     parser_copy.add_argument('deck1', help="Source deck")
@@ -120,19 +248,127 @@ def parse_arguments():
     )
     parser_copy.set_defaults(command=copyDeck)
 
+    parser_convert = subparsers.add_parser(
+        'convert',
+        help="Convert a note file between YAML and JSON Lines (.jsonl).")
+    parser_convert.add_argument('src', help='Note file to convert.')
+    parser_convert.add_argument(
+        'dst',
+        help='''Destination path; its extension selects the format. The source
+                          file is removed and its guid-map keys move to the
+                          destination.''')
+    parser_convert.set_defaults(command=convertNotes)
+
+    parser_ingest = subparsers.add_parser(
+        'ingest-csv',
+        help="Stream CSV rows into sharded JSON Lines note files.")
+    parser_ingest.add_argument(
+        'csv',
+        help='''CSV file with a header row. Columns are model fields,
+                          'field:lang' translations, the key column and an
+                          optional space-separated 'tags' column.''')
+    parser_ingest.add_argument(
+        'out', help='Directory under crawl.root that receives the shards.')
+    parser_ingest.add_argument('--model',
+                               dest='model',
+                               required=True,
+                               help='Model id from models.yaml for all notes.')
+    parser_ingest.add_argument('--key',
+                               dest='key',
+                               required=True,
+                               help='Column whose values become note ids.')
+    parser_ingest.add_argument('--shards',
+                               dest='shards',
+                               type=int,
+                               default=16,
+                               help='''Number of shard files; notes are placed by
+                          a hash of their key. [Default: 16]''')
+    parser_ingest.set_defaults(command=ingestCsv)
+
     parser_index = subparsers.add_parser(
         'index', help="Create or refresh guid-map entries for crawled notes.")
     parser_index.add_argument('--full',
                               dest='full',
                               action='store_true',
                               help='Regenerate all guid-map values.')
+    parser_index.add_argument(
+        'paths',
+        nargs='*',
+        help='''Note files to reindex. Only their guid-map entries are
+                          updated and no other note file is read; a path that
+                          no longer exists drops its entries.''')
+    addChangedSinceArgument(parser_index)
     parser_index.set_defaults(command=indexDeck)
 
+    parser_check = subparsers.add_parser(
+        'check',
+        help="Validate all crawled notes against models.yaml and build.json.")
+    parser_check.add_argument('--jobs',
+                              dest='jobs',
+                              type=int,
+                              default=None,
+                              help='''Number of parallel worker processes.
+                          [Default: number of CPUs]''')
+    addChangedSinceArgument(parser_check)
+    parser_check.set_defaults(command=checkDeck)
+
+    parser_dupes = subparsers.add_parser(
+        'dupes', help="Report exact and near-duplicate notes.")
+    parser_dupes.add_argument('--threshold',
+                              dest='threshold',
+                              type=float,
+                              default=0.8,
+                              help='''Estimated Jaccard similarity above which
+                          notes are reported as near duplicates. [Default: 0.8]''')
+    parser_dupes.add_argument('--jobs',
+                              dest='jobs',
+                              type=int,
+                              default=None,
+                              help='''Number of parallel worker processes.
+                          [Default: number of CPUs]''')
+    parser_dupes.set_defaults(command=findDupes)
+
+    parser_query = subparsers.add_parser(
+        'query', help="Find notes by words in their fields and by tags.")
+    parser_query.add_argument(
+        'words',
+        nargs='*',
+        help='''Words that must all occur in a note's fields. A trailing '*'
+                          matches any word with that prefix.''')
+    parser_query.add_argument('--tag',
+                              dest='tags',
+                              action='append',
+                              help='''Tag (manual or path-derived) the notes must
+                          carry; also matches its '::' children. May be repeated.''')
+    parser_query.add_argument('--limit',
+                              dest='limit',
+                              type=int,
+                              default=None,
+                              help='Print at most this many matches.')
+    parser_query.set_defaults(command=queryNotes)
+
     parser_sync = subparsers.add_parser(
         'sync',
         help="Sync changes from a CrowdAnki export back into anki-dm YAML files.")
     parser_sync.add_argument(
-        'path', help='Path to the exported CrowdAnki deck directory.')
+        'path',
+        nargs='*',
+        help='''Paths to exported CrowdAnki deck directories. Localized
+                          builds ('<deck>[<lang>]') update fields_by_lang.''')
+    parser_sync.add_argument(
+        '--from-collection',
+        dest='from_collection',
+        default=None,
+        help='''Read notes directly from an Anki collection file
+                          (collection.anki2), opened read-only, instead of a
+                          CrowdAnki export.''')
+    parser_sync.add_argument(
+        '--lang',
+        dest='collection_lang',
+        default=None,
+        help='''Language of the deck read with --from-collection; its
+                          fields update fields_by_lang. CrowdAnki exports
+                          carry their own language. [Default: default]''')
     parser_sync.add_argument(
         '--deck',
         dest='deck',
@@ -143,8 +379,10 @@ def parse_arguments():
         '--new-notes-file',
         dest='new_notes_file',
         default=None,
-        help='''Relative path (from crawl root) to append new notes from Anki.
-                          [Default: data.yaml]''')
+        help='''Relative path (from crawl root) to append new notes from Anki
+                          whose tags do not match the path tags of any note
+                          directory. Its file name is also preferred within a
+                          matching directory. [Default: data.yaml]''')
     parser_sync.add_argument(
         '--dry-run',
         dest='dry_run',
@@ -157,6 +395,18 @@ def parse_arguments():
                         default=".",
                         help='''Path to the deck set directory.
                           [Default: .]''')
+    parser.add_argument('--memory-profile',
+                        dest='memory_profile',
+                        action='store_true',
+                        help='''Report peak and retained memory with top
+                          allocation sites for each build/sync phase.''')
+    parser.add_argument('--memory-budget',
+                        dest='memory_budgets',
+                        action='append',
+                        metavar='PHASE=MB',
+                        help='''Fail when the peak memory of a phase exceeds MB.
+                          PHASE may be a glob, e.g. 'output:*=512'. Implies
+                          --memory-profile. May be repeated.''')
     parser.add_argument('--templates',
                         dest='templates',
                         action='store_true',
@@ -177,4 +427,6 @@ def main():
             util.err("No templates found")
 
     if args.command:
+        args.profile = memprofile.createProfile(
+            args.memory_profile, memprofile.parseBudgets(args.memory_budgets))
         args.command(args)
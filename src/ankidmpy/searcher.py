@@ -0,0 +1,196 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+import hashlib
+import json
+import os
+import os.path
+import sqlite3
+
+DEFAULT_SEARCH_INDEX = os.path.join('.cache', 'search-index.sqlite')
+INDEX_VERSION = 1
+SCHEMA = '''
+CREATE TABLE meta (
+    key             text primary key,
+    value           text not null
+);
+CREATE TABLE files (
+    rel_path        text primary key,
+    mtime           integer not null,
+    size            integer not null
+);
+CREATE TABLE notes (
+    id              integer primary key,
+    rel_path        text not null,
+    ref             text not null
+);
+CREATE TABLE postings (
+    token           text not null,
+    note            integer not null,
+    primary key (token, note)
+) WITHOUT ROWID;
+CREATE INDEX ix_notes_rel_path on notes (rel_path);
+'''
+WORD_PREFIX = 'w:'
+TAG_PREFIX = 't:'
+
+
+def _configHash(config):
+    payload = json.dumps([INDEX_VERSION, config['path_tags']], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _openIndex(path, config_hash):
+    connection = sqlite3.connect(path)
+    try:
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = 'config'").fetchone()
+    except sqlite3.DatabaseError:
+        row = None
+    if row is not None and row[0] == config_hash:
+        return connection
+
+    # Missing, unreadable or built with other path_tags rules.
+    connection.close()
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    with connection:
+        connection.execute("INSERT INTO meta VALUES ('config', ?)",
+                           (config_hash,))
+    return connection
+
+
+def _noteTokens(note_entry, path_tags):
+    note = note_entry['note']
+    values = []
+    fields = note.get('fields')
+    if isinstance(fields, dict):
+        values.extend(fields.values())
+    fields_by_lang = note.get('fields_by_lang')
+    if isinstance(fields_by_lang, dict):
+        for localized in fields_by_lang.values():
+            if isinstance(localized, dict):
+                values.extend(localized.values())
+
+    tokens = set(WORD_PREFIX + word
+                 for word in util.normalizeText(values).split())
+    tags = builder._mergeTags(
+        [builder._normalizeTags(note.get('tags')), path_tags])
+    tokens.update(TAG_PREFIX + tag.lower() for tag in tags)
+    return tokens
+
+
+def _fileStat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _updateIndex(connection, config):
+    data_files = builder._findDataFiles(config)
+    indexed = dict((rel_path, (mtime, size)) for rel_path, mtime, size in
+                   connection.execute('SELECT rel_path, mtime, size FROM files'))
+
+    changed = []
+    for data_file in data_files:
+        stat = _fileStat(data_file['path'])
+        if indexed.pop(data_file['rel_path'], None) != stat:
+            changed.append((data_file, stat))
+    removed = sorted(indexed.keys())
+    if not changed and not removed:
+        return 0, 0
+
+    path_tags_cache = dict()
+    with connection:
+        for rel_path in removed + [data_file['rel_path']
+                                   for data_file, _ in changed]:
+            connection.execute(
+                'DELETE FROM postings WHERE note IN '
+                '(SELECT id FROM notes WHERE rel_path = ?)', (rel_path,))
+            connection.execute('DELETE FROM notes WHERE rel_path = ?',
+                               (rel_path,))
+            connection.execute('DELETE FROM files WHERE rel_path = ?',
+                               (rel_path,))
+
+        for data_file, stat in changed:
+            note_entries = builder._dataFileNotes(
+                data_file, builder._readDataFile(data_file),
+                util.createStringTable())
+            rel_dir = data_file['rel_dir']
+            if config['path_tags'] and rel_dir not in path_tags_cache:
+                path_tags_cache[rel_dir] = builder._deriveTagsFromPath(
+                    rel_dir, config['path_tags'])
+            path_tags = path_tags_cache.get(rel_dir, [])
+
+            for note_entry in note_entries:
+                note_id = connection.execute(
+                    'INSERT INTO notes (rel_path, ref) VALUES (?, ?)',
+                    (data_file['rel_path'],
+                     builder._noteIdRef(note_entry))).lastrowid
+                connection.executemany(
+                    'INSERT INTO postings VALUES (?, ?)',
+                    ((token, note_id)
+                     for token in _noteTokens(note_entry, path_tags)))
+            connection.execute('INSERT INTO files VALUES (?, ?, ?)',
+                               (data_file['rel_path'],) + stat)
+    return len(changed), len(removed)
+
+
+def _termClause(term):
+    # A trailing '*' matches every token with that prefix; tags also match
+    # their hierarchical children.
+    if term.startswith(TAG_PREFIX):
+        tag = term.lower()
+        return ('SELECT note FROM postings WHERE token = ? OR '
+                '(token >= ? AND token < ?)', (tag, tag + '::', tag + ':;'))
+    if term.endswith('*'):
+        prefix = term[:-1]
+        return ('SELECT note FROM postings WHERE token >= ? AND token < ?',
+                (prefix, prefix + '\U0010ffff'))
+    return 'SELECT note FROM postings WHERE token = ?', (term,)
+
+
+def _queryTerms(words, tags):
+    terms = []
+    for word in words or []:
+        prefix = word.endswith('*')
+        tokens = util.normalizeText([word]).split()
+        for i, token in enumerate(tokens):
+            wildcard = '*' if prefix and i == len(tokens) - 1 else ''
+            terms.append(WORD_PREFIX + token + wildcard)
+    for tag in tags or []:
+        tag = tag.strip()
+        if tag:
+            terms.append(TAG_PREFIX + tag)
+    if not terms:
+        util.err("Nothing to query: give at least one word or --tag.")
+    return terms
+
+
+def queryIt(base, words, tags=None, limit=None):
+    config = builder.loadAnkiDmConfig(base)
+    terms = _queryTerms(words, tags)
+
+    index_path = os.path.join(base, DEFAULT_SEARCH_INDEX)
+    util.prepareDir(os.path.dirname(index_path))
+    connection = _openIndex(index_path, _configHash(config))
+    try:
+        n_changed, n_removed = _updateIndex(connection, config)
+        if n_changed or n_removed:
+            util.warn("Search index updated: %d file(s) reindexed, %d removed."
+                      % (n_changed, n_removed))
+
+        clauses = [_termClause(term) for term in terms]
+        sql = ('SELECT ref FROM notes WHERE id IN (%s) ORDER BY rel_path, id'
+               % (' INTERSECT '.join(clause for clause, _ in clauses),))
+        params = [param for _, clause_params in clauses
+                  for param in clause_params]
+        if limit:
+            sql += ' LIMIT %d' % (int(limit),)
+        refs = [ref for ref, in connection.execute(sql, params)]
+    finally:
+        connection.close()
+
+    for ref in refs:
+        util.msg(ref)
+    return refs
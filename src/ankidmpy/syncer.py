@@ -1,7 +1,17 @@
 import ankidmpy.builder as builder
+import ankidmpy.memprofile as memprofile
+import ankidmpy.minifier as minifier
 import ankidmpy.util as util
+import json
 import os
 import os.path
+import pathlib
+import re
+import sqlite3
+
+COLLECTION_UUID_RE = re.compile(rb'crowdanki_uuid"\s*:\s*"([0-9a-f-]+)"')
+LOCALIZED_DECK_RE = re.compile(r'\[([^\[\]]+)\]$')
+DEFAULT_NOTE_COUNTS_FILE = 'note-counts.json'
 
 
 def _parseCrowdAnki(crowdanki_path):
@@ -13,6 +23,113 @@ def _parseCrowdAnki(crowdanki_path):
     return util.getJson(filenm)
 
 
+def _crowdAnkiSource(crowdanki_data):
+    # crowdanki_uuid → ordered field name list
+    crowdanki_model_fields = {}
+    for nm in crowdanki_data.get('note_models', []):
+        crowdanki_model_fields[nm['crowdanki_uuid']] = [
+            f['name'] for f in nm.get('flds', [])
+        ]
+    return crowdanki_model_fields, crowdanki_data.get('notes', [])
+
+
+def _collectionModels(connection, models_config):
+    # Anki model id → (crowdanki uuid, ordered field names).  Models CrowdAnki
+    # has not tagged with a uuid are matched on the name used in build.json.
+    uuid_by_name = dict((cfg.get('name'), cfg['uuid'])
+                        for cfg in models_config.values())
+    result = dict()
+
+    raw = connection.execute('SELECT models FROM col').fetchone()[0]
+    models = json.loads(raw) if raw else {}
+    if models:
+        for model in models.values():
+            uuid = model.get('crowdanki_uuid') or uuid_by_name.get(model['name'])
+            fields = [f['name'] for f in sorted(model['flds'],
+                                                key=lambda f: f['ord'])]
+            result[int(model['id'])] = (uuid, fields)
+        return result
+
+    # Schema 15+ keeps note types in their own tables.
+    fields_by_model = dict()
+    for ntid, name in connection.execute(
+            'SELECT ntid, name FROM fields ORDER BY ntid, ord'):
+        fields_by_model.setdefault(ntid, []).append(name)
+    for ntid, name, config in connection.execute(
+            'SELECT id, name, config FROM notetypes'):
+        match = COLLECTION_UUID_RE.search(bytes(config or b''))
+        uuid = match.group(1).decode('ascii') if match else \
+            uuid_by_name.get(name)
+        result[ntid] = (uuid, fields_by_model.get(ntid, []))
+    return result
+
+
+def _collectionDeckIds(connection, deck_name):
+    raw = connection.execute('SELECT decks FROM col').fetchone()[0]
+    decks = json.loads(raw) if raw else {}
+    if decks:
+        names = [(int(d['id']), d['name']) for d in decks.values()]
+    else:
+        names = [(did, name.replace('\x1f', '::'))
+                 for did, name in connection.execute('SELECT id, name FROM decks')]
+    return [
+        did for did, name in names
+        if name == deck_name or name.startswith(deck_name + '::')
+    ]
+
+
+def _collectionSource(collection_path, models_config, deck_name, lang):
+    if not os.path.isfile(collection_path):
+        util.err("Anki collection not found: %s" % (collection_path,))
+    # A localized build carries its language in the deck name and in the
+    # note type uuids, as util.uuidEncode transforms them.
+    if lang != 'default':
+        deck_name = '%s[%s]' % (deck_name, lang)
+        models_config = dict(
+            (mid, dict(cfg, uuid=util.uuidEncode(cfg['uuid'], lang)))
+            for mid, cfg in models_config.items())
+    connection = sqlite3.connect(
+        pathlib.Path(collection_path).resolve().as_uri() + '?mode=ro',
+        uri=True)
+
+    models = _collectionModels(connection, models_config)
+    known_uuids = set(cfg['uuid'] for cfg in models_config.values())
+    model_fields = dict()
+    uuid_by_mid = dict()
+    for mid, (uuid, fields) in models.items():
+        if uuid in known_uuids:
+            model_fields[uuid] = fields
+            uuid_by_mid[mid] = uuid
+    if not uuid_by_mid:
+        connection.close()
+        util.err("No note types of deck '%s' found in '%s'." %
+                 (deck_name, collection_path))
+
+    query = 'SELECT guid, mid, flds, tags FROM notes WHERE mid IN (%s)' % (
+        ', '.join('?' * len(uuid_by_mid)),)
+    params = list(uuid_by_mid.keys())
+    deck_ids = _collectionDeckIds(connection, deck_name)
+    if deck_ids:
+        query += ' AND id IN (SELECT nid FROM cards WHERE did IN (%s))' % (
+            ', '.join('?' * len(deck_ids)),)
+        params.extend(deck_ids)
+    else:
+        util.warn("Deck '%s' not found in '%s'; syncing all notes of its "
+                  "note types." % (deck_name, collection_path))
+
+    def notes():
+        try:
+            for guid, mid, flds, tags in connection.execute(query, params):
+                yield dict(guid=guid,
+                           note_model_uuid=uuid_by_mid[mid],
+                           fields=flds.split('\x1f'),
+                           tags=[tag for tag in tags.split(' ') if tag])
+        finally:
+            connection.close()
+
+    return model_fields, notes()
+
+
 def _findDeckName(base):
     decks_dir = os.path.join(base, 'decks')
     decks = util.getFilesList(decks_dir, 'dir')
@@ -32,6 +149,41 @@ def _loadDeckBuild(base, deck):
     return deck_dirname, data
 
 
+def _deckModelsConfig(build_data):
+    models_config = build_data.get('models') or {}
+    if not models_config:
+        util.err("build.json has no 'models' section.")
+    return models_config
+
+
+def _identifyExport(base, crowdanki_data, deck, crowdanki_path):
+    # Localized builds are named '<deck>[<lang>]' and carry deck uuids
+    # transformed by util.uuidEncode for that language.
+    name = crowdanki_data.get('name') or ''
+    match = LOCALIZED_DECK_RE.search(name)
+    langs = ['default'] + ([match.group(1)] if match else [])
+    export_uuid = crowdanki_data.get('crowdanki_uuid')
+
+    decks_dir = os.path.join(base, 'decks')
+    deck_dirnames = [deck] if deck else util.getFilesList(decks_dir, 'dir')
+    for deck_dirname in deck_dirnames:
+        _, build_data = _loadDeckBuild(base, deck_dirname)
+        deck_uuid = (build_data.get('deck') or {}).get('uuid')
+        if not deck_uuid:
+            continue
+        for lang in langs:
+            if util.uuidEncode(deck_uuid, lang) == export_uuid:
+                return deck_dirname, build_data, lang
+
+    # Exports that do not carry a known deck uuid are synced as the
+    # default language of --deck, as before.
+    if not deck and len(deck_dirnames) > 1:
+        util.err("Cannot tell which deck '%s' was exported from; specify "
+                 "--deck." % (crowdanki_path,))
+    deck_dirname, build_data = _loadDeckBuild(base, deck)
+    return deck_dirname, build_data, 'default'
+
+
 def _parseKey(key):
     if key.startswith('id:'):
         rest = key[3:]
@@ -54,56 +206,194 @@ def _relDir(rel_path):
     return '' if d in ('', '.') else d
 
 
-def _stripPathTags(tags, rel_dir, path_tags_config):
+def _stripPathTags(tags, rel_dir, path_tags_config, path_tags_cache=None):
     if not path_tags_config or not rel_dir:
         return list(tags)
-    path_derived = set(builder._deriveTagsFromPath(rel_dir, path_tags_config))
+    if path_tags_cache is None:
+        path_tags_cache = dict()
+    path_derived = _pathTags(rel_dir, path_tags_config, path_tags_cache)
     return [t for t in tags if t not in path_derived]
 
 
-def _applyFileOps(file_ops, crawl_root, guid_map):
+def _pathTags(rel_dir, path_tags_config, path_tags_cache):
+    if rel_dir not in path_tags_cache:
+        path_tags_cache[rel_dir] = set(
+            builder._deriveTagsFromPath(rel_dir, path_tags_config))
+    return path_tags_cache[rel_dir]
+
+
+def _routingTrie(config, file_name, path_tags_cache):
+    # Trie of the directories that hold note files.  Each node keeps the path
+    # tags shared by every directory below it, so a note lacking them skips
+    # the whole subtree.  A directory receives new notes in its `file_name`
+    # note file, or else in the first of its note files by path.
+    root = dict(children=dict())
+    for data_file in builder._findDataFiles(config):
+        rel_dir = data_file['rel_dir']
+        if not rel_dir:
+            continue
+        tags = _pathTags(rel_dir, config['path_tags'], path_tags_cache)
+        if not tags:
+            continue
+        node = root
+        for part in rel_dir.split('/'):
+            node = node['children'].setdefault(
+                part, dict(children=dict(), common=set(tags)))
+            node['common'] &= tags
+        current = node.get('rel_path')
+        if current is None or (
+                os.path.basename(current) != file_name and
+                os.path.basename(data_file['rel_path']) == file_name):
+            node['rel_path'] = data_file['rel_path']
+        node['tags'] = tags
+    return root
+
+
+def _routeNote(trie, tags):
+    # The note file of the directory whose path tags the note carries most
+    # of; None when no directory matches or two match equally well.
+    best = None
+    best_size = 0
+    tied = False
+    stack = list(trie['children'].values())
+    while stack:
+        node = stack.pop()
+        if not node['common'] <= tags:
+            continue
+        if 'tags' in node and node['tags'] <= tags:
+            if len(node['tags']) > best_size:
+                best, best_size, tied = node['rel_path'], len(node['tags']), False
+            elif len(node['tags']) == best_size:
+                tied = True
+        stack.extend(node['children'].values())
+    return None if tied else best
+
+
+def _renderedValue(value, minify=False):
+    # The value as a deck built with or without --minify holds it.
+    if minify and isinstance(value, str):
+        return minifier.minifyHtml(value)
+    return '' if value is None else str(value)
+
+
+def _wasMinified(note, model, built_fingerprint):
+    # Whether the last build minified the note's fields, told by which of the
+    # raw or minified values its recorded fingerprint was taken from.
+    fields = note.get('fields')
+    if built_fingerprint is None or not isinstance(fields, dict) or \
+            minifier.keepsFieldWhitespace(model):
+        return False
+    tags = builder._normalizeTags(note.get('tags'))
+    if builder._noteFingerprint(fields, model['fields'],
+                                tags) == built_fingerprint:
+        return False
+    minified = dict((name, _renderedValue(value, True))
+                    for name, value in fields.items())
+    return builder._noteFingerprint(minified, model['fields'],
+                                    tags) == built_fingerprint
+
+
+def _syncedFields(fields, values, minify):
+    # Exported values that match what was built keep their source text.
+    return dict(
+        (field_name, fields[field_name] if field_name in fields and
+         value == _renderedValue(fields[field_name], minify) else value)
+        for field_name, value in values.items())
+
+
+def _applyLocalizedFields(note, lang, values, built_defaults, minify=False):
+    # A value the localized deck was built with was not edited there, even
+    # if the default field changed since.  Edited values become overrides
+    # unless they match the default field.
+    defaults = note.get('fields') if isinstance(note.get('fields'), dict) else {}
+    fields_by_lang = note.get('fields_by_lang')
+    if not isinstance(fields_by_lang, dict):
+        fields_by_lang = {}
+    previous = fields_by_lang.get(lang)
+    localized = dict(previous) if isinstance(previous, dict) else {}
+    for field_name, value in values.items():
+        built = localized.get(field_name, built_defaults.get(field_name))
+        if value == _renderedValue(built, minify):
+            continue
+        if value == _renderedValue(defaults.get(field_name), minify):
+            localized.pop(field_name, None)
+        else:
+            localized[field_name] = value
+    if localized == (previous or {}):
+        return False
+
+    fields_by_lang = dict(fields_by_lang)
+    if localized:
+        fields_by_lang[lang] = localized
+    else:
+        fields_by_lang.pop(lang, None)
+    if fields_by_lang:
+        note['fields_by_lang'] = fields_by_lang
+    else:
+        note.pop('fields_by_lang', None)
+    return True
+
+
+def _locateNote(notes, locator, id_index):
+    if locator['type'] == 'id':
+        return id_index.get(locator['value'])
+    idx = locator['value']
+    return idx if 0 <= idx < len(notes) else None
+
+
+def _applyFileOps(file_ops, crawl_root, guid_map, models, built_fingerprints):
     for rel_path, ops in sorted(file_ops.items()):
         abs_path = os.path.join(crawl_root, rel_path)
-        data = util.getYaml(abs_path, required=True)
+        data = util.getNotes(abs_path, required=True)
         notes = data.get('notes', [])
         if not isinstance(notes, list):
             util.err("File '%s' must contain a 'notes' list." % abs_path)
+        id_index = dict()
+        for i, note in enumerate(notes):
+            id_index.setdefault(str(note.get('id', '')), i)
 
         # Apply field/tag updates in-place (before any index shifts)
-        for op in ops.get('updates', []):
+        changed = False
+        for key, op in ops['updates'].items():
             loc = op['locator']
-            if loc['type'] == 'id':
-                for note in notes:
-                    if str(note.get('id', '')) == loc['value']:
-                        note['fields'] = op['fields']
-                        note['tags'] = op['tags']
-                        break
-                else:
+            idx = _locateNote(notes, loc, id_index)
+            if idx is None:
+                if loc['type'] == 'id':
                     util.warn("Could not find note with id '%s' in '%s' for update." %
                               (loc['value'], rel_path))
-            else:
-                idx = loc['value']
-                if 0 <= idx < len(notes):
-                    notes[idx]['fields'] = op['fields']
-                    notes[idx]['tags'] = op['tags']
                 else:
                     util.warn("Note index %d out of range in '%s' for update." %
-                              (idx, rel_path))
+                              (loc['value'], rel_path))
+                continue
+            note = notes[idx]
+            built_defaults = note.get('fields') if isinstance(
+                note.get('fields'), dict) else {}
+            model = models.get(note.get('model'))
+            minify = model is not None and _wasMinified(
+                note, model, built_fingerprints.get(guid_map.get(key)))
+            if op['fields'] is not None:
+                fields = _syncedFields(built_defaults, op['fields'], minify)
+                if note.get('fields') != fields:
+                    note['fields'] = fields
+                    changed = True
+            if op['tags'] is not None and note.get('tags') != op['tags']:
+                note['tags'] = op['tags']
+                changed = True
+            for lang, values in sorted(op['fields_by_lang'].items()):
+                if _applyLocalizedFields(note, lang, values, built_defaults,
+                                         minify):
+                    changed = True
 
         # Collect deletion indices
         delete_indices = set()
-        for op in ops.get('deletions', []):
+        for op in ops['deletions']:
             loc = op['locator']
-            if loc['type'] == 'id':
-                found = False
-                for i, note in enumerate(notes):
-                    if str(note.get('id', '')) == loc['value']:
-                        delete_indices.add(i)
-                        found = True
-                        break
-                if not found:
-                    util.warn("Could not find note with id '%s' in '%s' for deletion." %
-                              (loc['value'], rel_path))
+            idx = _locateNote(notes, loc, id_index)
+            if idx is not None:
+                delete_indices.add(idx)
+            elif loc['type'] == 'id':
+                util.warn("Could not find note with id '%s' in '%s' for deletion." %
+                          (loc['value'], rel_path))
             else:
                 delete_indices.add(loc['value'])
 
@@ -121,19 +411,80 @@ def _applyFileOps(file_ops, crawl_root, guid_map):
                 new_notes.append(note)
                 new_idx += 1
             notes = new_notes
+            changed = True
 
+        if not changed:
+            continue
         data['notes'] = notes
-        with open(abs_path, 'w') as f:
-            f.write(util.toYaml(data))
+        util.writeNotes(abs_path, data)
 
 
-def _applyAdditions(additions, crawl_root, new_notes_rel_path, guid_map):
-    if not additions:
-        return
+def _loadNoteCounts(cache_dir):
+    return builder._loadParseCache(
+        os.path.join(cache_dir, DEFAULT_NOTE_COUNTS_FILE))
+
+
+def _writeNoteCounts(cache_dir, counts):
+    util.prepareDir(cache_dir)
+    with open(os.path.join(cache_dir, DEFAULT_NOTE_COUNTS_FILE), 'w') as f:
+        f.write(json.dumps(counts, ensure_ascii=False))
+
+
+def _recordNoteCount(counts, rel_path, abs_path, count, indent):
+    stat = os.stat(abs_path)
+    counts[rel_path] = dict(size=stat.st_size,
+                            mtime=stat.st_mtime_ns,
+                            count=count,
+                            indent=indent)
+
+
+def _appendLayout(counts, rel_path, abs_path):
+    # (note count, item indent) of a file whose notes list runs to its end,
+    # so new notes can be appended as text; None when that is not safe.
+    entry = counts.get(rel_path)
+    stat = os.stat(abs_path)
+    if isinstance(entry, dict) and entry.get('size') == stat.st_size and \
+            entry.get('mtime') == stat.st_mtime_ns:
+        return entry['count'], entry['indent']
+    raw = util.getRaw(abs_path)
+    if util.isJsonl(abs_path):
+        return sum(1 for line in raw.splitlines() if line.strip()), 0
+    chunks = util.splitYamlNotes(raw)
+    if chunks is None:
+        return None
+    return len(chunks), len(chunks[0]) - len(chunks[0].lstrip(' '))
+
+
+def _appendNotes(abs_path, notes, indent):
+    if util.isJsonl(abs_path):
+        text = util.toJsonl(notes)
+    else:
+        text = ''.join(
+            ' ' * indent + line if line.strip() else line
+            for note in notes
+            for line in util.toYaml([note]).splitlines(True))
+    with open(abs_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            text = '\n' + text
+    with open(abs_path, 'a') as f:
+        f.write(text)
+
+
+def _addNotes(abs_path, rel_path, new_notes, counts):
+    # Add notes to the end of a note file and return the index of the first.
+    layout = None
+    if os.path.exists(abs_path):
+        layout = _appendLayout(counts, rel_path, abs_path)
+    if layout is not None:
+        count, indent = layout
+        _appendNotes(abs_path, new_notes, indent)
+        _recordNoteCount(counts, rel_path, abs_path, count + len(new_notes),
+                         indent)
+        return count
 
-    abs_path = os.path.join(crawl_root, new_notes_rel_path)
     if os.path.exists(abs_path):
-        data = util.getYaml(abs_path, required=True)
+        data = util.getNotes(abs_path, required=True)
         notes = data.get('notes', [])
         if not isinstance(notes, list):
             notes = []
@@ -141,122 +492,252 @@ def _applyAdditions(additions, crawl_root, new_notes_rel_path, guid_map):
         util.prepareDir(os.path.dirname(abs_path))
         data = {}
         notes = []
+    count = len(notes)
+    notes.extend(new_notes)
+    data['notes'] = notes
+    util.writeNotes(abs_path, data)
+    counts.pop(rel_path, None)
+    if list(data) == ['notes']:
+        _recordNoteCount(counts, rel_path, abs_path, len(notes), 0)
+    return count
 
-    for add_op in additions:
-        new_idx = len(notes)
-        note = {'model': add_op['model_id'], 'fields': add_op['fields']}
-        if add_op['tags']:
-            note['tags'] = add_op['tags']
-        notes.append(note)
 
-        key = 'idx:%s#%d' % (new_notes_rel_path, new_idx)
-        guid_map[key] = util.guidEncode(add_op['crowdanki_guid'], add_op['model_uuid'])
+def _additionsByFile(additions):
+    by_file = dict()
+    for add_op in additions:
+        by_file.setdefault(add_op['rel_path'], []).append(add_op)
+    return by_file
 
-    data['notes'] = notes
-    with open(abs_path, 'w') as f:
-        f.write(util.toYaml(data))
 
+def _applyAdditions(additions, crawl_root, guid_map, cache_dir):
+    if not additions:
+        return
 
-def syncIt(crowdanki_path, base, deck, new_notes_file, dry_run):
+    counts = _loadNoteCounts(cache_dir)
+    for rel_path, file_additions in _additionsByFile(additions).items():
+        new_notes = []
+        for add_op in file_additions:
+            note = {'model': add_op['model_id'], 'fields': add_op['fields']}
+            if add_op['tags']:
+                note['tags'] = add_op['tags']
+            new_notes.append(note)
+
+        start = _addNotes(os.path.join(crawl_root, rel_path), rel_path,
+                          new_notes, counts)
+        for i, add_op in enumerate(file_additions):
+            key = 'idx:%s#%d' % (rel_path, start + i)
+            guid_map[key] = util.guidEncode(add_op['crowdanki_guid'],
+                                            add_op['model_uuid'])
+    _writeNoteCounts(cache_dir, counts)
+
+
+def syncIt(crowdanki_paths,
+           base,
+           deck,
+           new_notes_file,
+           dry_run,
+           profile=None,
+           collection_path=None,
+           collection_lang=None):
+    if isinstance(crowdanki_paths, str):
+        crowdanki_paths = [crowdanki_paths]
+    crowdanki_paths = crowdanki_paths or []
+    if bool(crowdanki_paths) == bool(collection_path):
+        util.err("Specify either CrowdAnki export paths or --from-collection.")
+    if collection_lang and not collection_path:
+        util.err("--lang only applies to --from-collection; CrowdAnki exports "
+                 "carry their language.")
+
+    memprofile.beginPhase(profile, 'sync:load')
     ankidm_config = builder.loadAnkiDmConfig(base)
     crawl_root = ankidm_config['crawl_root']
     path_tags_config = ankidm_config['path_tags']
 
     guid_map, guid_map_path = builder._loadGuidMap(base)
     reverse_map = {v: k for k, v in guid_map.items()}
-
-    _, build_data = _loadDeckBuild(base, deck)
-    models_config = build_data.get('models') or {}
-    if not models_config:
-        util.err("build.json has no 'models' section.")
-    uuid_to_model_id = {cfg['uuid']: mid for mid, cfg in models_config.items()}
-
-    crowdanki_data = _parseCrowdAnki(crowdanki_path)
-
-    # crowdanki_uuid → ordered field name list
-    crowdanki_model_fields = {}
-    for nm in crowdanki_data.get('note_models', []):
-        crowdanki_model_fields[nm['crowdanki_uuid']] = [
-            f['name'] for f in nm.get('flds', [])
-        ]
-
+    fingerprints, fingerprints_path = builder._loadFingerprints(base)
+    built_fingerprints = dict(fingerprints)
+
+    sources = []
+    if collection_path:
+        deck_dirname, build_data = _loadDeckBuild(base, deck)
+        models_config = _deckModelsConfig(build_data)
+        lang = collection_lang or 'default'
+        sources.append(
+            dict(label=collection_path,
+                 deck=deck_dirname,
+                 lang=lang,
+                 models_config=models_config,
+                 content=_collectionSource(collection_path, models_config,
+                                           util.filenameToDeck(deck_dirname),
+                                           lang)))
+    else:
+        for crowdanki_path in crowdanki_paths:
+            crowdanki_data = _parseCrowdAnki(crowdanki_path)
+            deck_dirname, build_data, lang = _identifyExport(
+                base, crowdanki_data, deck, crowdanki_path)
+            sources.append(
+                dict(label=crowdanki_path,
+                     deck=deck_dirname,
+                     lang=lang,
+                     models_config=_deckModelsConfig(build_data),
+                     content=_crowdAnkiSource(crowdanki_data)))
+    # Default-language exports go first so localized overrides are compared
+    # against the updated default fields.
+    sources.sort(key=lambda source: source['lang'] != 'default')
+    has_default = any(source['lang'] == 'default' for source in sources)
+
+    strings = util.createStringTable()
+    path_tags_cache = dict()
     matched_keys = set()
     file_ops = {}
     additions = []
-
-    for note in crowdanki_data.get('notes', []):
-        crowdanki_guid = note.get('guid', '')
-        model_uuid = note.get('note_model_uuid', '')
-
-        if model_uuid not in uuid_to_model_id:
-            util.warn("Skipping note with unknown model UUID: %s" % model_uuid)
-            continue
-
-        model_id = uuid_to_model_id[model_uuid]
-        internal_guid = util.guidEncode(crowdanki_guid, models_config[model_id]['uuid'])
-
-        field_names = crowdanki_model_fields.get(model_uuid, [])
-        fields_data = dict(zip(field_names, note.get('fields', [])))
-        crowdanki_tags = note.get('tags', [])
-
-        if internal_guid in reverse_map:
-            key = reverse_map[internal_guid]
-            matched_keys.add(key)
-            rel_path, locator = _parseKey(key)
-            manual_tags = _stripPathTags(crowdanki_tags, _relDir(rel_path),
-                                         path_tags_config)
-            ops = file_ops.setdefault(rel_path, {'updates': [], 'deletions': []})
-            ops['updates'].append({
-                'locator': locator,
-                'fields': fields_data,
-                'tags': manual_tags,
-            })
-        else:
-            new_rel_dir = _relDir(new_notes_file or 'data.yaml')
-            manual_tags = _stripPathTags(crowdanki_tags, new_rel_dir, path_tags_config)
-            additions.append({
-                'model_id': model_id,
-                'fields': fields_data,
-                'tags': manual_tags,
-                'crowdanki_guid': crowdanki_guid,
-                'model_uuid': models_config[model_id]['uuid'],
-            })
+    n_unchanged = 0
+    n_skipped_new = 0
+    target_file = new_notes_file or 'data.yaml'
+    routing_trie = None
+
+    for source in sources:
+        lang = source['lang']
+        models_config = source['models_config']
+        uuid_to_model_id = dict(
+            (util.uuidEncode(cfg['uuid'], lang), mid)
+            for mid, cfg in models_config.items())
+        crowdanki_model_fields, crowdanki_notes = source['content']
+        if len(sources) > 1:
+            util.msg("Syncing '%s' (deck: %s, language: %s)" %
+                     (source['label'], source['deck'], lang))
+
+        for note in crowdanki_notes:
+            crowdanki_guid = note.get('guid', '')
+            model_uuid = note.get('note_model_uuid', '')
+
+            if model_uuid not in uuid_to_model_id:
+                util.warn("Skipping note with unknown model UUID: %s" % model_uuid)
+                continue
+
+            model_id = uuid_to_model_id[model_uuid]
+            internal_guid = util.guidEncode(crowdanki_guid, model_uuid)
+
+            field_names = crowdanki_model_fields.get(model_uuid, [])
+            fields_data = dict(
+                zip(field_names, [
+                    util.internValue(strings, value)
+                    for value in note.get('fields', [])
+                ]))
+            crowdanki_tags = [
+                util.internString(strings, tag) for tag in note.get('tags', [])
+            ]
+
+            if internal_guid in reverse_map:
+                key = reverse_map[internal_guid]
+                matched_keys.add(key)
+                rel_path, locator = _parseKey(key)
+                manual_tags = _stripPathTags(crowdanki_tags, _relDir(rel_path),
+                                             path_tags_config, path_tags_cache)
+                fingerprint = builder._noteFingerprint(fields_data, field_names,
+                                                       manual_tags)
+                fingerprint_key = builder._fingerprintKey(internal_guid, lang)
+                if built_fingerprints.get(
+                        fingerprint_key,
+                        built_fingerprints.get(internal_guid)) == fingerprint:
+                    n_unchanged += 1
+                    continue
+                fingerprints[fingerprint_key] = fingerprint
+                ops = file_ops.setdefault(rel_path, {'updates': {}, 'deletions': []})
+                op = ops['updates'].setdefault(
+                    key, {
+                        'locator': locator,
+                        'fields': None,
+                        'tags': None,
+                        'fields_by_lang': {},
+                    })
+                if lang == 'default':
+                    op['fields'] = fields_data
+                else:
+                    op['fields_by_lang'][lang] = fields_data
+                # Tags are shared by all languages; a default-language
+                # export has the final word on them.
+                if op['tags'] is None or lang == 'default':
+                    op['tags'] = manual_tags
+            elif lang != 'default':
+                n_skipped_new += 1
+            else:
+                # New notes go to the directory their path tags point at,
+                # and to the new-notes file when none does.
+                rel_path = None
+                if path_tags_config:
+                    if routing_trie is None:
+                        routing_trie = _routingTrie(
+                            ankidm_config, os.path.basename(target_file),
+                            path_tags_cache)
+                    rel_path = _routeNote(routing_trie, set(crowdanki_tags))
+                rel_path = rel_path or target_file
+                manual_tags = _stripPathTags(crowdanki_tags, _relDir(rel_path),
+                                             path_tags_config, path_tags_cache)
+                fingerprints[internal_guid] = builder._noteFingerprint(
+                    fields_data, field_names, manual_tags)
+                additions.append({
+                    'model_id': model_id,
+                    'fields': fields_data,
+                    'tags': manual_tags,
+                    'crowdanki_guid': crowdanki_guid,
+                    'model_uuid': model_uuid,
+                    'rel_path': rel_path,
+                })
 
     deleted_keys = set()
-    for key in guid_map:
-        if key not in matched_keys:
-            rel_path, locator = _parseKey(key)
-            ops = file_ops.setdefault(rel_path, {'updates': [], 'deletions': []})
-            ops['deletions'].append({'key': key, 'locator': locator})
-            deleted_keys.add(key)
+    if has_default:
+        for key in guid_map:
+            if key not in matched_keys:
+                rel_path, locator = _parseKey(key)
+                ops = file_ops.setdefault(rel_path, {'updates': {}, 'deletions': []})
+                ops['deletions'].append({'key': key, 'locator': locator})
+                deleted_keys.add(key)
+        builder._dropFingerprints(fingerprints,
+                                  set(guid_map[key] for key in deleted_keys))
+    else:
+        util.warn("No default-language export given; deletions are not synced.")
+    if n_skipped_new:
+        util.warn("Skipped %d new note(s) found only in localized exports; add "
+                  "them in a default-language deck." % (n_skipped_new,))
 
     n_updated = sum(len(ops['updates']) for ops in file_ops.values())
     n_deleted = len(deleted_keys)
     n_added = len(additions)
-    target_file = new_notes_file or 'data.yaml'
+
+    memprofile.endPhase(profile)
 
     if dry_run:
         util.msg("Dry run — no changes written.")
         util.msg("  Updated notes: %d" % n_updated)
+        util.msg("  Unchanged notes: %d" % n_unchanged)
         util.msg("  Deleted notes: %d" % n_deleted)
         if n_deleted > 0:
             for key in sorted(deleted_keys):
                 util.msg("    - %s" % key)
         util.msg("  New notes:     %d" % n_added)
-        if n_added > 0:
-            util.msg("  New notes target: %s" % target_file)
+        for rel_path, file_additions in _additionsByFile(additions).items():
+            util.msg("  New notes target: %s (%d)" %
+                     (rel_path, len(file_additions)))
         return
 
-    _applyFileOps(file_ops, crawl_root, guid_map)
+    memprofile.beginPhase(profile, 'sync:apply')
+    _applyFileOps(file_ops, crawl_root, guid_map, builder._loadModels(base),
+                  built_fingerprints)
 
     for key in deleted_keys:
         guid_map.pop(key, None)
 
-    _applyAdditions(additions, crawl_root, target_file, guid_map)
+    _applyAdditions(additions, crawl_root, guid_map,
+                    builder._parseCacheDir(ankidm_config))
 
     builder._writeGuidMap(guid_map_path, guid_map)
-
-    util.msg("Sync complete: updated=%d, deleted=%d, added=%d" %
-             (n_updated, n_deleted, n_added))
-    if n_added > 0:
-        util.msg("  New notes added to: %s" % target_file)
+    builder._writeFingerprints(fingerprints_path, fingerprints)
+    memprofile.endPhase(profile)
+
+    util.msg("Sync complete: updated=%d, unchanged=%d, deleted=%d, added=%d" %
+             (n_updated, n_unchanged, n_deleted, n_added))
+    for rel_path, file_additions in _additionsByFile(additions).items():
+        util.msg("  New notes added to: %s (%d)" %
+                 (rel_path, len(file_additions)))
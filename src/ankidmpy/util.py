@@ -1,13 +1,25 @@
 import csv
+import html
 import json
 import re
 from collections import defaultdict
 import uuid
 import random
 import os.path
+import queue
+import subprocess
 import sys
+import threading
 import yaml
 
+JSON_SPLICE_MARKER = '@@ankidm-splice-'
+YAML_NOTES_HEADER_RE = re.compile(r'notes:[ \t]*(#.*)?$')
+YAML_ITEM_RE = re.compile(r'-(?:[ \t]|$)')
+JSONL_EXT = '.jsonl'
+INTERN_VALUE_MAX_LENGTH = 64
+CLOZE_TEXT_RE = re.compile(r'{{c\d+::(.*?)(?:::[^}]*)?}}', re.S)
+HTML_TAG_RE = re.compile(r'<[^>]*>')
+NON_WORD_RE = re.compile(r'\W+', re.U)
 GUID_CHARS = 'abcdefghijklmnopqrstuvwxyz' + 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' + '0123456789' + "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
 
 
@@ -30,9 +42,91 @@ def warn(msg):
     print(msg, file=sys.stderr)
 
 
+def normalizeText(values):
+    # Lower-cased words of the field values, without HTML and cloze markup.
+    text = ' '.join(str(value) for value in values if value is not None)
+    text = CLOZE_TEXT_RE.sub(r'\1', text)
+    text = html.unescape(HTML_TAG_RE.sub(' ', text))
+    return NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+def createStringTable():
+    return dict(strings=dict(),
+                seen=set(),
+                total_count=0,
+                total_bytes=0,
+                unique_bytes=0)
+
+
+def internString(table, value):
+    if table is None or not isinstance(value, str):
+        return value
+    size = sys.getsizeof(value)
+    table['total_count'] += 1
+    table['total_bytes'] += size
+    known = table['strings'].get(value)
+    if known is not None:
+        return known
+    table['strings'][value] = value
+    table['unique_bytes'] += size
+    return value
+
+
+def internValue(table, value):
+    # Short values are interned outright.  A longer one is interned from its
+    # second occurrence on, so the table never holds values seen only once.
+    if table is None or not isinstance(value, str):
+        return value
+    if len(value) > INTERN_VALUE_MAX_LENGTH and value not in table['strings']:
+        digest = hash(value)
+        if digest not in table['seen']:
+            table['seen'].add(digest)
+            return value
+    return internString(table, value)
+
+
+def stringTableStats(table):
+    return dict(unique_count=len(table['strings']),
+                total_count=table['total_count'],
+                unique_bytes=table['unique_bytes'],
+                total_bytes=table['total_bytes'])
+
+
+def _postprocessJson(res):
+    return re.sub(r'/^(  +?)\\1(?=[^ ])/m', '\1', res)
+
+
 def toJson(data):
     res = json.dumps(data, indent=2, ensure_ascii=False)
-    return re.sub(r'/^(  +?)\\1(?=[^ ])/m', '\1', res)
+    return _postprocessJson(res)
+
+
+def toJsonFragment(data, level):
+    res = json.dumps(data, indent=2, ensure_ascii=False)
+    return res.replace('\n', '\n' + '  ' * level)
+
+
+def toJsonSpliced(data, splices, level=1):
+    # Serialize 'data' with each data[key] in 'splices' rendered from
+    # pre-serialized list items (see toJsonFragment).  The result is
+    # identical to toJson() of the fully materialized data.
+    spliced = dict(data)
+    markers = dict()
+    for key in splices:
+        marker = '%s%s@@' % (JSON_SPLICE_MARKER, uuid.uuid4().hex)
+        spliced[key] = marker
+        markers[key] = json.dumps(marker)
+    res = json.dumps(spliced, indent=2, ensure_ascii=False)
+
+    indent = '  ' * (level + 1)
+    for key, fragments in splices.items():
+        if fragments:
+            body = '[\n%s%s\n%s]' % (indent, (',\n' + indent).join(fragments),
+                                     '  ' * level)
+        else:
+            body = '[]'
+        res = res.replace(markers[key], body, 1)
+    return _postprocessJson(res)
 
 
 def toYaml(data):
@@ -42,6 +136,59 @@ def toYaml(data):
                           default_flow_style=False)
 
 
+def _emitYamlNode(dumper, value):
+    node = dumper.represent_data(value)
+    dumper.anchor_node(node)
+    dumper.serialize_node(node, None, None)
+    # Forget the item once it is written so memory stays bounded by the
+    # largest item rather than the whole document.
+    dumper.represented_objects = {}
+    dumper.object_keeper = []
+    dumper.alias_key = None
+    dumper.anchors = {}
+    dumper.serialized_nodes = {}
+
+
+def writeYaml(f, data, stream_key, pairs=False):
+    # Write the top-level mapping `data` to `f` exactly as toYaml would, except
+    # that data[stream_key] (a list or any iterator, of (key, value) pairs when
+    # `pairs` is set) is emitted one item at a time.  Objects shared between
+    # items are written out in full instead of as anchors and aliases.
+    dumper = yaml.SafeDumper(f,
+                             allow_unicode=True,
+                             sort_keys=False,
+                             default_flow_style=False)
+    try:
+        dumper.open()
+        dumper.emit(
+            yaml.DocumentStartEvent(explicit=dumper.use_explicit_start,
+                                    version=dumper.use_version,
+                                    tags=dumper.use_tags))
+        dumper.emit(yaml.MappingStartEvent(None, None, True, flow_style=False))
+        for key, value in data.items():
+            _emitYamlNode(dumper, key)
+            if key != stream_key:
+                _emitYamlNode(dumper, value)
+            elif pairs:
+                dumper.emit(
+                    yaml.MappingStartEvent(None, None, True, flow_style=False))
+                for item_key, item_value in value:
+                    _emitYamlNode(dumper, item_key)
+                    _emitYamlNode(dumper, item_value)
+                dumper.emit(yaml.MappingEndEvent())
+            else:
+                dumper.emit(
+                    yaml.SequenceStartEvent(None, None, True, flow_style=False))
+                for item in value:
+                    _emitYamlNode(dumper, item)
+                dumper.emit(yaml.SequenceEndEvent())
+        dumper.emit(yaml.MappingEndEvent())
+        dumper.emit(yaml.DocumentEndEvent(explicit=dumper.use_explicit_end))
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
 def getFilesList(directory, typ='file'):
     data = []
     try:
@@ -114,10 +261,87 @@ def getJson(fn, required=True):
     return json.loads(data)
 
 
+def writeRaw(fn, contents):
+    with open(fn, 'w') as f:
+        f.write(contents)
+
+
+def readAhead(paths, depth=16):
+    # Yield (path, contents) in order while a background thread keeps up to
+    # 'depth' files read ahead of the consumer.
+    results = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    end = object()
+
+    def reader():
+        try:
+            for path in paths:
+                if stop.is_set():
+                    return
+                results.put((path, getRaw(path)))
+        except Exception as ex:
+            results.put((end, ex))
+            return
+        results.put((end, None))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            path, data = results.get()
+            if path is end:
+                if data is not None:
+                    raise data
+                return
+            yield path, data
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+def submitBounded(executor, pending, depth, fn, *args):
+    # Run fn(*args) on 'executor', blocking while 'depth' tasks are still in
+    # flight.  Without an executor the call runs inline.
+    if executor is None:
+        fn(*args)
+        return
+    while len(pending) >= depth:
+        pending.popleft().result()
+    pending.append(executor.submit(fn, *args))
+
+
+def drainPending(pending):
+    while pending:
+        pending.popleft().result()
+
+
+def runGit(cwd, *args):
+    # Output of a local git command, or None when git is missing or fails.
+    try:
+        result = subprocess.run(['git'] + list(args),
+                                cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout
+
+
 def getYaml(fn, required=True):
     data = getRaw(fn, required)
     if data is None:
         return None
+    return parseYaml(fn, data)
+
+
+def parseYaml(fn, data):
     if not data.strip():
         return {}
     try:
@@ -127,45 +351,146 @@ def getYaml(fn, required=True):
     return loaded if loaded is not None else {}
 
 
-def getCsv(fn, required=True):
+def isJsonl(fn):
+    return str(fn).lower().endswith(JSONL_EXT)
+
+
+def _parseJsonlLines(fn, lines):
+    notes = []
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            notes.append(json.loads(line))
+        except ValueError as ex:
+            err("Cannot parse JSON Lines '%s' at line %d: %s" %
+                (fn, line_no, ex))
+    return dict(notes=notes)
+
+
+def parseJsonl(fn, data):
+    return _parseJsonlLines(fn, data.splitlines())
+
+
+def parseNotes(fn, data):
+    if isJsonl(fn):
+        return parseJsonl(fn, data)
+    return parseYaml(fn, data)
+
+
+def getNotes(fn, required=True):
+    if not isJsonl(fn):
+        return getYaml(fn, required)
     if not required and not os.path.exists(fn):
         return None
+    with open(fn) as f:
+        return _parseJsonlLines(fn, f)
+
+
+def toJsonl(notes):
+    return ''.join(
+        json.dumps(note, ensure_ascii=False) + '\n' for note in notes)
+
+
+def dumpNotes(fn, data):
+    # JSON Lines files hold the notes list only.
+    if isJsonl(fn):
+        return toJsonl(data.get('notes') or [])
+    return toYaml(data)
+
+
+def writeNotes(fn, data):
+    # Streaming counterpart of writeRaw(fn, dumpNotes(fn, data)).
+    with open(fn, 'w') as f:
+        if isJsonl(fn):
+            for note in data.get('notes') or []:
+                f.write(json.dumps(note, ensure_ascii=False) + '\n')
+        elif 'notes' in data:
+            writeYaml(f, data, 'notes')
+        else:
+            f.write(toYaml(data))
+
+
+def splitYamlNotes(data):
+    # Split a document that holds nothing but a block 'notes:' list into the
+    # text of its top-level items.  Returns None for any other layout.
+    lines = data.splitlines(True)
+    start = 0
+    while start < len(lines) and (not lines[start].strip() or
+                                  lines[start].startswith('#')):
+        start += 1
+    if start == len(lines) or not YAML_NOTES_HEADER_RE.match(lines[start]):
+        return None
+
+    indent = None
+    chunks = []
+    for line in lines[start + 1:]:
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            if chunks:
+                chunks[-1].append(line)
+            continue
+        lead = len(line) - len(line.lstrip(' '))
+        if indent is None:
+            indent = lead
+        if lead == indent and YAML_ITEM_RE.match(line, indent):
+            chunks.append([line])
+        elif lead > indent and chunks:
+            chunks[-1].append(line)
+        else:
+            return None
+    if not chunks:
+        return None
+    return [''.join(chunk) for chunk in chunks]
+
+
+def parseYamlItem(data):
+    # Parse the text of one list item as produced by splitYamlNotes; None
+    # when it does not stand on its own.
+    try:
+        loaded = yaml.safe_load(data)
+    except Exception:
+        return None
+    if not isinstance(loaded, list) or len(loaded) != 1:
+        return None
+    return loaded[0]
+
 
+def _csvColumns(header):
     default_cols = dict()
     translated_cols = defaultdict(dict)
-    result = defaultdict(lambda: defaultdict(list))
-    with open(fn, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        header = next(reader)
-        for i, col in enumerate(header):
-            if ':' in col:
-                field, lang = col.rsplit(':', 1)
-                if field == 'guid':
-                    warn('Translating "guid" field doesn\'t make any sense.')
-                translated_cols[lang][field] = i
-            else:
-                default_cols[col] = i
+    for i, col in enumerate(header):
+        if ':' in col:
+            field, lang = col.rsplit(':', 1)
+            if field == 'guid':
+                warn('Translating "guid" field doesn\'t make any sense.')
+            translated_cols[lang][field] = i
+        else:
+            default_cols[col] = i
+    return default_cols, translated_cols
 
-        langs = dict()
-        langs['default'] = dict((idx, field)
-                                for field, idx in default_cols.items())
-        for lang, cols in translated_cols.items():
-            merged = dict(default_cols)
-            merged.update(cols)
-            langs[lang] = dict((idx, field) for field, idx in merged.items())
 
+def iterCsv(fn):
+    # Yield (line_no, fields, fields_by_lang) one row at a time.  Translated
+    # 'field:lang' columns only appear in fields_by_lang when not empty.
+    with open(fn, newline='') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, None)
+        if header is None:
+            return
+        default_cols, translated_cols = _csvColumns(header)
         for row in reader:
-            for lang, cols in langs.items():
-                for i, field in cols.items():
-                    result[lang][field].append(row[i] if i < len(row) else '')
-
-    if not result:
-        # Preserve schema for each language even when there are no note rows.
-        for lang, cols in langs.items():
-            for col in cols.values():
-                result[lang][col] = []
-
-    return result
+            if not any(cell.strip() for cell in row):
+                continue
+            fields = dict((field, row[i] if i < len(row) else '')
+                          for field, i in default_cols.items())
+            fields_by_lang = dict()
+            for lang, cols in translated_cols.items():
+                localized = dict((field, row[i]) for field, i in cols.items()
+                                 if i < len(row) and row[i] != '')
+                if localized:
+                    fields_by_lang[lang] = localized
+            yield reader.line_num, fields, fields_by_lang
 
 
 def createGuid():
@@ -0,0 +1,71 @@
+import ankidmpy.builder as builder
+import ankidmpy.importer as importer
+import ankidmpy.util as util
+import os.path
+import pytest
+import sqlite3
+import zipfile
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', 'src', 'ankidmpy',
+                            'templates', 'Default')
+
+NOTES = [
+    dict(id='n1',
+         model='basic',
+         fields=dict(Front='Capital of <b>France</b>',
+                     Back='Paris <img src="paris.png">'),
+         tags=['geo', 'europe']),
+    dict(id='n2',
+         model='basic',
+         fields=dict(Front='Capital of Peru', Back='Lima'),
+         tags=['geo']),
+    dict(id='n3', model='basic', fields=dict(Front='Front only', Back=''),
+         tags=[]),
+]
+
+
+@pytest.fixture
+def deck_set(tmp_path):
+    """A deck set 'Test' with a two-template model, three notes and media."""
+    base = str(tmp_path / 'src')
+    util.prepareDir(base)
+    importer.importIt(TEMPLATE_DIR, base, 'Test')
+
+    models = util.getYaml(os.path.join(base, 'models.yaml'))
+    models['models'][0]['templates'].append(
+        dict(name='Card 2',
+             qfmt='{{Back}}',
+             afmt='{{FrontSide}}<hr id=answer>{{Front}}'))
+    with open(os.path.join(base, 'models.yaml'), 'w') as f:
+        f.write(util.toYaml(models))
+    util.writeNotes(os.path.join(base, 'data.yaml'), dict(notes=NOTES))
+
+    util.prepareDir(os.path.join(base, 'media'))
+    for name in ('paris.png', 'unused.png'):
+        with open(os.path.join(base, 'media', name), 'wb') as f:
+            f.write(name.encode('utf-8') * 4)
+    return base
+
+
+def buildCollection(deck_set, tmp_path, deck='Test'):
+    """Build the deck set to .apkg and extract its schema-11 collection."""
+    build_dir = str(tmp_path / 'build')
+    builder.build([], deck_set, build_dir, None, output_format='apkg')
+    with zipfile.ZipFile(os.path.join(build_dir, deck + '.apkg')) as package:
+        package.extract('collection.anki2', str(tmp_path))
+    return str(tmp_path / 'collection.anki2')
+
+
+def addCollectionNote(connection, note_id, guid, fields, tags):
+    """Add a note of the collection's only note type with one card."""
+    mid, did = connection.execute(
+        'SELECT notes.mid, cards.did FROM notes JOIN cards '
+        'ON cards.nid = notes.id LIMIT 1').fetchone()
+    connection.execute(
+        'INSERT INTO notes VALUES (?, ?, ?, 0, -1, ?, ?, ?, 0, 0, ?)',
+        (note_id, guid, mid, ' %s ' % ' '.join(tags), '\x1f'.join(fields),
+         fields[0], ''))
+    connection.execute(
+        'INSERT INTO cards VALUES '
+        '(?, ?, ?, 0, 0, -1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, ?)',
+        (note_id, note_id, did, ''))
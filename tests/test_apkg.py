@@ -0,0 +1,107 @@
+import ankidmpy.builder as builder
+import ankidmpy.util as util
+import hashlib
+import json
+import os.path
+import re
+import sqlite3
+import zipfile
+
+from conftest import NOTES
+
+
+def _buildBoth(deck_set, tmp_path):
+    build_dir = str(tmp_path / 'build')
+    builder.build([], deck_set, build_dir, None)
+    builder.build([], deck_set, build_dir, None, output_format='apkg')
+    crowdanki = util.getJson(os.path.join(build_dir, 'Test', 'Test.json'))
+    return crowdanki, os.path.join(build_dir, 'Test.apkg')
+
+
+def _openCollection(apkg_path, tmp_path):
+    with zipfile.ZipFile(apkg_path) as package:
+        package.extract('collection.anki2', str(tmp_path))
+    return sqlite3.connect(str(tmp_path / 'collection.anki2'))
+
+
+def _stableId(uuid):
+    return int(hashlib.sha1(uuid.encode('utf-8')).hexdigest()[:12], 16)
+
+
+def _checksum(value):
+    text = re.sub(r'<[^>]*>', '', value).strip()
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def test_col_models_and_decks(deck_set, tmp_path):
+    crowdanki, apkg_path = _buildBoth(deck_set, tmp_path)
+    connection = _openCollection(apkg_path, tmp_path)
+    ver, models, decks, dconf = connection.execute(
+        'SELECT ver, models, decks, dconf FROM col').fetchone()
+    connection.close()
+    assert ver == 11
+
+    note_model = crowdanki['note_models'][0]
+    model_id = _stableId(note_model['crowdanki_uuid'])
+    deck_id = _stableId(crowdanki['crowdanki_uuid'])
+    models = json.loads(models)
+    assert list(models) == [str(model_id)]
+    model = models[str(model_id)]
+    assert model['id'] == model_id
+    assert model['name'] == 'Basic'
+    assert model['did'] == deck_id
+    assert [field['name'] for field in model['flds']] == ['Front', 'Back']
+    assert [template['name'] for template in model['tmpls']
+            ] == ['Card 1', 'Card 2']
+    assert model['req'] == [[0, 'any', [0]], [1, 'any', [1]]]
+
+    decks = json.loads(decks)
+    assert sorted(decks) == sorted(['1', str(deck_id)])
+    assert decks[str(deck_id)]['name'] == 'Test'
+    dconf_id = _stableId(crowdanki['deck_config_uuid'])
+    assert decks[str(deck_id)]['conf'] == dconf_id
+    assert str(dconf_id) in json.loads(dconf)
+
+
+def test_notes_and_cards(deck_set, tmp_path):
+    crowdanki, apkg_path = _buildBoth(deck_set, tmp_path)
+    connection = _openCollection(apkg_path, tmp_path)
+    notes = connection.execute(
+        'SELECT id, guid, mid, tags, flds, sfld, csum FROM notes ORDER BY id'
+    ).fetchall()
+    cards = connection.execute(
+        'SELECT nid, did, ord FROM cards ORDER BY nid, ord').fetchall()
+    connection.close()
+
+    model_id = _stableId(crowdanki['note_models'][0]['crowdanki_uuid'])
+    deck_id = _stableId(crowdanki['crowdanki_uuid'])
+    assert len(notes) == len(crowdanki['notes']) == len(NOTES)
+    for row, note, source in zip(notes, crowdanki['notes'], NOTES):
+        _, guid, mid, tags, flds, sfld, csum = row
+        assert guid == note['guid']
+        assert mid == model_id
+        assert tags.split() == note['tags'] == source['tags']
+        assert flds == '\x1f'.join(note['fields'])
+        assert flds == '\x1f'.join(
+            [source['fields']['Front'], source['fields']['Back']])
+        assert sfld == re.sub(r'<[^>]*>', '', note['fields'][0])
+        assert csum == _checksum(note['fields'][0])
+
+    # One card per template whose fields are filled in.
+    cards_by_note = dict()
+    for nid, did, card_ord in cards:
+        assert did == deck_id
+        cards_by_note.setdefault(nid, []).append(card_ord)
+    assert [cards_by_note[row[0]] for row in notes] == [[0, 1], [0, 1], [0]]
+
+
+def test_media_map(deck_set, tmp_path):
+    _, apkg_path = _buildBoth(deck_set, tmp_path)
+    with zipfile.ZipFile(apkg_path) as package:
+        names = set(package.namelist())
+        media = json.loads(package.read('media'))
+        assert names == set(media) | set(['collection.anki2', 'media'])
+        assert sorted(media.values()) == ['paris.png']
+        for entry, media_file in media.items():
+            with open(os.path.join(deck_set, 'media', media_file), 'rb') as f:
+                assert package.read(entry) == f.read()
@@ -0,0 +1,66 @@
+import ankidmpy.builder as builder
+import os
+import os.path
+import pytest
+import shutil
+import subprocess
+
+pytestmark = pytest.mark.skipif(shutil.which('git') is None,
+                                reason='git is not installed')
+
+
+def _git(cwd, *args):
+    subprocess.run(('git', '-c', 'user.name=test', '-c',
+                    'user.email=test@example.com') + args,
+                   cwd=cwd,
+                   check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def _backs(config, **kwargs):
+    notes = builder._loadNotes(config, **kwargs)
+    return [entry['note']['fields']['Back'] for entry in notes]
+
+
+def _rewrite(path, old, new, mtime):
+    with open(path) as f:
+        raw = f.read()
+    with open(path, 'w') as f:
+        f.write(raw.replace(old, new))
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.fixture
+def repo(deck_set):
+    with open(os.path.join(deck_set, '.gitignore'), 'w') as f:
+        f.write('.cache/\n')
+    _git(deck_set, 'init', '-q')
+    _git(deck_set, 'add', '.')
+    _git(deck_set, 'commit', '-q', '-m', 'notes')
+    return deck_set
+
+
+def test_reverted_file_is_parsed_again(repo):
+    config = builder.loadAnkiDmConfig(repo)
+    data_path = os.path.join(repo, 'data.yaml')
+    mtime = os.stat(data_path).st_mtime_ns
+    assert _backs(config, changed_since='HEAD')[1] == 'Lima'
+
+    # An incremental build caches the edit, then the file is reverted to
+    # its committed content, which git does not report as changed.
+    _rewrite(data_path, 'Lima', 'Lime', mtime + 10**9)
+    assert _backs(config, incremental=True)[1] == 'Lime'
+    _rewrite(data_path, 'Lime', 'Lima', mtime + 2 * 10**9)
+    assert _backs(config, changed_since='HEAD')[1] == 'Lima'
+
+
+def test_subset_run_does_not_record_git_state(repo):
+    config = builder.loadAnkiDmConfig(repo)
+    state_path = os.path.join(builder._parseCacheDir(config),
+                              builder.DEFAULT_GIT_STATE_FILE)
+    builder._loadNotes(config,
+                       subtrees=['data.yaml'],
+                       changed_since='HEAD')
+    assert not os.path.exists(state_path)
+    builder._loadNotes(config, changed_since='HEAD')
+    assert os.path.exists(state_path)
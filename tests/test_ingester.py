@@ -0,0 +1,47 @@
+import ankidmpy.builder as builder
+import ankidmpy.ingester as ingester
+import ankidmpy.util as util
+import glob
+import os.path
+
+
+def _writeCsv(path, n):
+    with open(path, 'w') as f:
+        f.write('word_id,Front,Back,tags\n')
+        for i in range(n):
+            f.write('w%d,Front %d,Back %d,t%d\n' % (i, i, i, i % 3))
+
+
+def _ingestedGuids(deck_set):
+    guid_map, _ = builder._loadGuidMap(deck_set)
+    return dict((key[key.rfind('#') + 1:], guid)
+                for key, guid in guid_map.items() if '/part-' in key)
+
+
+def _shardIds(out_dir):
+    ids = []
+    for path in sorted(glob.glob(os.path.join(out_dir, 'part-*.jsonl'))):
+        ids.extend(note['id'] for note in util.getNotes(path)['notes'])
+    return ids
+
+
+def test_reingest_with_fewer_shards(deck_set, tmp_path):
+    csv_path = str(tmp_path / 'words.csv')
+    out_dir = os.path.join(deck_set, 'words')
+    _writeCsv(csv_path, 40)
+    builder.build([], deck_set, str(tmp_path / 'build'), None)
+
+    ingester.ingestCsv(deck_set, csv_path, out_dir, 'basic', 'word_id', 8)
+    guids = _ingestedGuids(deck_set)
+    assert len(guids) == 40
+
+    ingester.ingestCsv(deck_set, csv_path, out_dir, 'basic', 'word_id', 2)
+    assert sorted(os.listdir(out_dir)) == ['part-0000.jsonl', 'part-0001.jsonl']
+    assert sorted(_shardIds(out_dir)) == sorted('w%d' % i for i in range(40))
+    assert _ingestedGuids(deck_set) == guids
+
+    # Notes outside the shards keep their entries.
+    guid_map, _ = builder._loadGuidMap(deck_set)
+    assert len(guid_map) == 40 + 3
+    assert all(key.startswith('id:data.yaml#') for key in guid_map
+               if '/part-' not in key)
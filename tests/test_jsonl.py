@@ -0,0 +1,51 @@
+import ankidmpy.builder as builder
+import ankidmpy.checker as checker
+import ankidmpy.searcher as searcher
+import ankidmpy.util as util
+import os.path
+import pytest
+
+
+@pytest.fixture
+def jsonl_deck_set(deck_set, monkeypatch):
+    path = os.path.join(deck_set, 'more.jsonl')
+    util.writeNotes(
+        path,
+        dict(notes=[
+            dict(id='j%d' % (i,),
+                 model='basic',
+                 fields=dict(Front='Line %d' % (i,), Back='')) for i in range(3)
+        ]))
+    with open(os.path.join(deck_set, 'ankidm.yaml'), 'w') as f:
+        f.write(
+            util.toYaml(
+                dict(crawl=dict(root='.',
+                                include=['**/data.yaml', '**/*.jsonl'],
+                                exclude=['build/**']))))
+
+    # JSON Lines files must be streamed, never read into memory whole.
+    get_raw = util.getRaw
+
+    def getRaw(fn, required=True):
+        assert not util.isJsonl(fn), fn
+        return get_raw(fn, required)
+
+    monkeypatch.setattr(util, 'getRaw', getRaw)
+    return deck_set
+
+
+@pytest.mark.parametrize('pipelined', [True, False])
+def test_load_streams_jsonl(jsonl_deck_set, pipelined):
+    config = builder.loadAnkiDmConfig(jsonl_deck_set)
+    notes = builder._loadNotes(config, pipelined=pipelined, incremental=True)
+    assert [entry['note']['id'] for entry in notes
+            ] == ['n1', 'n2', 'n3', 'j0', 'j1', 'j2']
+
+
+def test_index_check_and_query_stream_jsonl(jsonl_deck_set):
+    config = builder.loadAnkiDmConfig(jsonl_deck_set)
+    builder.reindexGuidMapFiles(config, [os.path.join(jsonl_deck_set,
+                                                      'more.jsonl')],
+                                jsonl_deck_set, False)
+    checker.checkIt(jsonl_deck_set)
+    assert searcher.queryIt(jsonl_deck_set, ['line', '1']) == ['more.jsonl#j1']
@@ -0,0 +1,32 @@
+import ankidmpy.builder as builder
+import ankidmpy.minifier as minifier
+import ankidmpy.util as util
+import os.path
+
+
+def test_minify_html_keeps_value_ends():
+    assert minifier.minifyHtml(' Paris  is   big ') == ' Paris is big '
+    assert minifier.minifyHtml('a <b>bold</b>\n') == 'a <b>bold</b> '
+    assert minifier.minifyHtml('<div> x </div>  <br>\ny') == '<div>x</div><br>y'
+    assert minifier.minifyHtml(' <!-- note --> {{Front}}  ') == ' {{Front}} '
+
+
+def test_minify_cache_covers_fingerprinted_values(deck_set, tmp_path,
+                                                  monkeypatch):
+    # A French-only build still fingerprints the default-language values.
+    data_path = os.path.join(deck_set, 'data.yaml')
+    data = util.getNotes(data_path)
+    data['notes'][0]['fields_by_lang'] = dict(fr=dict(Back='Paris  (FR)'))
+    util.writeNotes(data_path, data)
+    build_dir = str(tmp_path / 'build')
+    builder.build([], deck_set, build_dir, 'fr', minify=True)
+    cache = util.getJson(
+        os.path.join(build_dir, '.cache', minifier.DEFAULT_MINIFY_CACHE))
+    assert cache['version'] == minifier.MINIFY_VERSION
+
+    calls = []
+    minify_html = minifier.minifyHtml
+    monkeypatch.setattr(minifier, 'minifyHtml',
+                        lambda html: calls.append(html) or minify_html(html))
+    builder.build([], deck_set, build_dir, 'fr', minify=True)
+    assert calls == []
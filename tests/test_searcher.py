@@ -0,0 +1,13 @@
+import ankidmpy.searcher as searcher
+import os.path
+
+
+def test_query_index_lives_in_cache(deck_set):
+    assert searcher.queryIt(deck_set, ['capital']) == ['data.yaml#n1',
+                                                      'data.yaml#n2']
+    assert searcher.queryIt(deck_set, ['FRANCE'], tags=['europe']) == [
+        'data.yaml#n1'
+    ]
+    assert os.path.isfile(
+        os.path.join(deck_set, '.cache', 'search-index.sqlite'))
+    assert not os.path.exists(os.path.join(deck_set, 'search-index.sqlite'))
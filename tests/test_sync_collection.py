@@ -0,0 +1,91 @@
+import ankidmpy.builder as builder
+import ankidmpy.syncer as syncer
+import ankidmpy.util as util
+import os.path
+import sqlite3
+
+from conftest import addCollectionNote, buildCollection
+
+
+def _notesById(deck_set):
+    notes = util.getNotes(os.path.join(deck_set, 'data.yaml'))['notes']
+    return dict((note.get('id'), note) for note in notes)
+
+
+def test_sync_from_collection(deck_set, tmp_path):
+    collection = buildCollection(deck_set, tmp_path)
+    connection = sqlite3.connect(collection)
+    with connection:
+        rows = connection.execute(
+            'SELECT id, guid, mid, flds FROM notes ORDER BY id').fetchall()
+        n1, _, n3 = rows
+        connection.execute('UPDATE notes SET flds = ?, tags = ? WHERE id = ?',
+                           ('Capital of <b>France</b>\x1fParis!', ' geo ',
+                            n1[0]))
+        connection.execute('DELETE FROM cards WHERE nid = ?', (n3[0],))
+        connection.execute('DELETE FROM notes WHERE id = ?', (n3[0],))
+        addCollectionNote(connection, 1, 'newGuid',
+                          ['Capital of Chile', 'Santiago'], ['geo', 'new'])
+    connection.close()
+
+    syncer.syncIt([], deck_set, 'Test', None, False,
+                  collection_path=collection)
+
+    notes = _notesById(deck_set)
+    assert sorted(notes, key=str) == sorted(['n1', 'n2', None], key=str)
+    assert notes['n1']['fields'] == dict(Front='Capital of <b>France</b>',
+                                         Back='Paris!')
+    assert notes['n1']['tags'] == ['geo']
+    assert notes['n2']['fields'] == dict(Front='Capital of Peru', Back='Lima')
+    assert notes[None]['model'] == 'basic'
+    assert notes[None]['fields'] == dict(Front='Capital of Chile',
+                                         Back='Santiago')
+    assert notes[None]['tags'] == ['geo', 'new']
+
+    guid_map, _ = builder._loadGuidMap(deck_set)
+    assert len(guid_map) == 3
+    assert not any(key.endswith('#n3') for key in guid_map)
+
+
+def test_sync_from_localized_collection(deck_set, tmp_path):
+    data_path = os.path.join(deck_set, 'data.yaml')
+    data = util.getNotes(data_path)
+    data['notes'][1]['fields_by_lang'] = dict(fr=dict(Front='Capitale du Pérou'))
+    util.writeNotes(data_path, data)
+
+    collection = buildCollection(deck_set, tmp_path, 'Test_fr')
+    connection = sqlite3.connect(collection)
+    with connection:
+        connection.execute(
+            'UPDATE notes SET flds = ? WHERE flds = ?',
+            ('Capitale de la Pérou\x1fLima', 'Capitale du Pérou\x1fLima'))
+        connection.execute('DELETE FROM notes WHERE flds LIKE ?', ('Front%',))
+    connection.close()
+
+    syncer.syncIt([], deck_set, 'Test', None, False,
+                  collection_path=collection, collection_lang='fr')
+
+    notes = _notesById(deck_set)
+    assert sorted(notes) == ['n1', 'n2', 'n3']
+    assert notes['n2']['fields'] == dict(Front='Capital of Peru', Back='Lima')
+    assert notes['n2']['fields_by_lang'] == dict(
+        fr=dict(Front='Capitale de la Pérou'))
+
+
+def test_collection_path_with_uri_characters(deck_set, tmp_path):
+    collection = buildCollection(deck_set, tmp_path)
+    odd_dir = tmp_path / 'odd ?#%41 dir'
+    odd_dir.mkdir()
+    odd_collection = str(odd_dir / 'collection.anki2')
+    os.rename(collection, odd_collection)
+    connection = sqlite3.connect(odd_collection)
+    with connection:
+        connection.execute('UPDATE notes SET flds = ? WHERE flds = ?',
+                           ('Capital of Peru\x1fLima!',
+                            'Capital of Peru\x1fLima'))
+    connection.close()
+
+    syncer.syncIt([], deck_set, 'Test', None, False,
+                  collection_path=odd_collection)
+
+    assert _notesById(deck_set)['n2']['fields']['Back'] == 'Lima!'
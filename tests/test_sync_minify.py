@@ -0,0 +1,78 @@
+import ankidmpy.builder as builder
+import ankidmpy.syncer as syncer
+import ankidmpy.util as util
+import json
+import os.path
+import pytest
+
+
+@pytest.fixture
+def minified_build(deck_set, tmp_path):
+    data_path = os.path.join(deck_set, 'data.yaml')
+    data = util.getNotes(data_path)
+    data['notes'][0]['fields']['Back'] = 'Paris  is   big'
+    data['notes'][1]['fields_by_lang'] = dict(fr=dict(Front='Capitale du Pérou'))
+    util.writeNotes(data_path, data)
+    build_dir = str(tmp_path / 'build')
+    builder.build([], deck_set, build_dir, None, minify=True)
+    return build_dir
+
+
+def _editExport(build_dir, deck, front, new_front):
+    path = os.path.join(build_dir, deck, deck + '.json')
+    export = util.getJson(path)
+    edited = [note for note in export['notes'] if note['fields'][0] == front]
+    assert len(edited) == 1 and edited[0]['fields'][1] == 'Paris is big'
+    edited[0]['fields'][0] = new_front
+    with open(path, 'w') as f:
+        f.write(json.dumps(export))
+    return os.path.join(build_dir, deck)
+
+
+def _notesById(deck_set):
+    notes = util.getNotes(os.path.join(deck_set, 'data.yaml'))['notes']
+    return dict((note['id'], note) for note in notes)
+
+
+def test_default_sync_keeps_unedited_source_text(deck_set, minified_build):
+    export = _editExport(minified_build, 'Test', 'Capital of <b>France</b>',
+                         'Capital of France')
+
+    syncer.syncIt([export], deck_set, 'Test', None, False)
+
+    notes = _notesById(deck_set)
+    assert notes['n1']['fields'] == dict(Front='Capital of France',
+                                         Back='Paris  is   big')
+    assert 'fields_by_lang' not in notes['n1']
+    assert notes['n2']['fields_by_lang'] == dict(
+        fr=dict(Front='Capitale du Pérou'))
+
+
+def test_localized_sync_writes_only_edited_overrides(deck_set, minified_build):
+    export = _editExport(minified_build, 'Test', 'Capital of <b>France</b>',
+                         'Capital of France')
+    export_fr = _editExport(minified_build, 'Test_fr',
+                            'Capital of <b>France</b>', 'Capitale de la France')
+
+    syncer.syncIt([export, export_fr], deck_set, 'Test', None, False)
+
+    notes = _notesById(deck_set)
+    assert notes['n1']['fields'] == dict(Front='Capital of France',
+                                         Back='Paris  is   big')
+    assert notes['n1']['fields_by_lang'] == dict(
+        fr=dict(Front='Capitale de la France'))
+    assert notes['n2']['fields_by_lang'] == dict(
+        fr=dict(Front='Capitale du Pérou'))
+
+
+def test_localized_export_alone(deck_set, minified_build):
+    export_fr = _editExport(minified_build, 'Test_fr',
+                            'Capital of <b>France</b>', 'Capitale de la France')
+
+    syncer.syncIt([export_fr], deck_set, 'Test', None, False)
+
+    notes = _notesById(deck_set)
+    assert notes['n1']['fields'] == dict(Front='Capital of <b>France</b>',
+                                         Back='Paris  is   big')
+    assert notes['n1']['fields_by_lang'] == dict(
+        fr=dict(Front='Capitale de la France'))
@@ -0,0 +1,75 @@
+import ankidmpy.syncer as syncer
+import ankidmpy.util as util
+import os
+import os.path
+import shutil
+import sqlite3
+
+from conftest import addCollectionNote, buildCollection
+
+NOTE_FILES = [
+    'geo/asia/cards.yaml',
+    'geo/europe/data.yaml',
+    'geo/europe/extra.jsonl',
+    'geo/americas/part.jsonl',
+]
+
+
+def _routedDeckSet(deck_set):
+    notes_dir = os.path.join(deck_set, 'notes')
+    util.prepareDir(notes_dir)
+    shutil.move(os.path.join(deck_set, 'data.yaml'),
+                os.path.join(notes_dir, 'data.yaml'))
+    for i, rel_path in enumerate(NOTE_FILES):
+        path = os.path.join(notes_dir, rel_path)
+        util.prepareDir(os.path.dirname(path))
+        util.writeNotes(
+            path,
+            dict(notes=[
+                dict(id='f%d' % (i,),
+                     model='basic',
+                     fields=dict(Front='File %d' % (i,), Back=''))
+            ]))
+    with open(os.path.join(deck_set, 'ankidm.yaml'), 'w') as f:
+        f.write(
+            util.toYaml(
+                dict(crawl=dict(root='notes',
+                                include=['**/*.yaml', '**/*.jsonl'],
+                                exclude=[]),
+                     path_tags=dict(levels=[dict(name='topic', index=0)]))))
+    return notes_dir
+
+
+def _ids(path):
+    return [note.get('id') for note in util.getNotes(path)['notes']]
+
+
+def test_new_notes_go_to_a_file_of_the_matched_directory(deck_set, tmp_path):
+    notes_dir = _routedDeckSet(deck_set)
+    collection = buildCollection(deck_set, tmp_path)
+    connection = sqlite3.connect(collection)
+    with connection:
+        addCollectionNote(connection, 1, 'g1', ['Tokyo', ''], ['geo', 'asia'])
+        addCollectionNote(connection, 2, 'g2', ['Rome', ''],
+                          ['geo', 'europe', 'city'])
+        addCollectionNote(connection, 3, 'g3', ['Quito', ''],
+                          ['americas', 'geo'])
+        addCollectionNote(connection, 4, 'g4', ['Mars', ''], ['space'])
+    connection.close()
+
+    syncer.syncIt([], deck_set, 'Test', None, False,
+                  collection_path=collection)
+
+    # Each note file of a directory counts; data.yaml wins within one.
+    added = dict()
+    for rel_path in NOTE_FILES + ['data.yaml']:
+        notes = util.getNotes(os.path.join(notes_dir, rel_path))['notes']
+        added[rel_path] = [(note['fields']['Front'], note.get('tags'))
+                           for note in notes if 'id' not in note]
+    assert added == {
+        'geo/asia/cards.yaml': [('Tokyo', None)],
+        'geo/europe/data.yaml': [('Rome', ['city'])],
+        'geo/europe/extra.jsonl': [],
+        'geo/americas/part.jsonl': [('Quito', None)],
+        'data.yaml': [('Mars', ['space'])],
+    }
@@ -0,0 +1,15 @@
+import ankidmpy.util as util
+
+
+def test_intern_value_dedupes_short_and_repeated_values():
+    strings = util.createStringTable()
+    short = ''.join(['See the ', 'summary.'])
+    assert util.internValue(strings, short) is short
+    assert util.internValue(strings, ''.join(['See the ', 'summary.'])) is short
+
+    long_value = 'x' * (util.INTERN_VALUE_MAX_LENGTH + 1)
+    assert util.internValue(strings, long_value) is long_value
+    assert long_value not in strings['strings']
+    second = util.internValue(strings, ''.join(['x'] * len(long_value)))
+    assert util.internValue(strings, ''.join(['x'] * len(long_value))) is second
+    assert util.internValue(strings, 3) == 3